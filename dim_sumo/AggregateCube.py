@@ -0,0 +1,183 @@
+import os
+import numpy as np
+from ResultStore import ResultStore
+
+
+class AggregateCube:
+    """Aggregates of the trips of the experiments, precomputed per run, movement and role.
+
+    Each row holds the count, sum, sum of squares, minimum, maximum and a histogram (used as quantile sketch) of the
+    measures of the trips of one run with one movement and role. Any table or tendency over the swept parameters is
+    then a sum of rows instead of a pass over every trip. Rows are replaced run by run, so the cube is updated with
+    only the runs ingested since the last update (see ResultStore.ingest). Loading the cube never writes it, the
+    runs of the store missing from it (a cube deleted or saved before the store) are only added by refresh.
+    """
+
+    KEYS = ("freq_1", "freq_3", "prob_1", "prob_3", "movement", "role")
+    MEASURES = ("duration", "waitingTime")
+    # Histogram of the measures, values over the last edge are counted in the last bin
+    BIN_SECONDS = 2.0
+    MAX_SECONDS = 3600.0
+    ROLES = ("regular", "emergency", "flaw", "deceiver")
+    # Movement of the vehicles by the lane they depart from (the original crosses) or the route of their id
+    LANE_MOVEMENTS = {"1i_0": "W->E", "3i_0": "N->S"}
+    ROUTE_MOVEMENTS = {"right": "W->E", "left": "E->W", "down": "N->S", "up": "S->N"}
+    CUBE_FILE = "cube.npz"
+
+    def __init__(self, directory="data/store"):
+        """
+        Args:
+            directory (str, optional): Directory the cube is saved in, the one of the ResultStore whose runs it
+                aggregates. Defaults to "data/store".
+        """
+        self.directory = directory
+        self.bins = int(self.MAX_SECONDS / self.BIN_SECONDS)
+        self.rows = self._empty_rows()
+        cube_file = os.path.join(self.directory, self.CUBE_FILE)
+        if os.path.exists(cube_file):
+            with np.load(cube_file) as cube:
+                self.rows = {name: cube[name] for name in cube.files}
+
+    def refresh(self):
+        """Adds the runs of the ResultStore of the directory that are missing from the cube and saves it if any
+
+        Returns:
+            list of dict: the entries of the manifest of the runs added
+        """
+        runs = set(self.rows["run"].tolist())
+        missing = [entry for source, entry in sorted(ResultStore(self.directory).manifest.items()) if source not in runs]
+        self.update(missing)
+        return missing
+
+    def _empty_rows(self):
+        rows = dict(run=np.array([], dtype=str), freq_1=np.array([]), freq_3=np.array([]), prob_1=np.array([]),
+                    prob_3=np.array([]), movement=np.array([], dtype=str), role=np.array([], dtype=str),
+                    count=np.array([], dtype=np.int64))
+        for measure in self.MEASURES:
+            rows[f"{measure}_sum"] = np.array([])
+            rows[f"{measure}_sum_squares"] = np.array([])
+            rows[f"{measure}_min"] = np.array([])
+            rows[f"{measure}_max"] = np.array([])
+            rows[f"{measure}_histogram"] = np.zeros((0, self.bins), dtype=np.int32)
+        return rows
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        cube_file = os.path.join(self.directory, self.CUBE_FILE)
+        temporary_file = f"{cube_file}.{os.getpid()}.tmp.npz"
+        np.savez(temporary_file, **self.rows)
+        os.replace(temporary_file, cube_file)
+
+    def movements(self, trips):
+        """Movement of each trip, "NA" if it can not be told"""
+        movements = np.full(len(trips["id"]), "NA", dtype=object)
+        for prefix, movement in self.ROUTE_MOVEMENTS.items():
+            movements[np.char.startswith(trips["id"], prefix)] = movement
+        for lane, movement in self.LANE_MOVEMENTS.items():
+            movements[trips["departLane"] == lane] = movement
+        return movements.astype(str)
+
+    def roles(self, trips):
+        """Role of each trip, see ROLES"""
+        roles = np.full(len(trips["id"]), "regular", dtype=object)
+        roles[trips["is_deceiver"]] = "deceiver"
+        roles[trips["is_flaw"]] = "flaw"
+        roles[trips["is_emergency"]] = "emergency"
+        return roles.astype(str)
+
+    def run_rows(self, entry, trips):
+        """Rows of the aggregates of one run
+
+        Args:
+            entry (dict): Entry of the manifest of the ResultStore for the run
+            trips (dict): Columns of the trips of the run, see TripinfoReader.read
+
+        Returns:
+            dict: the columns of the rows, one per movement and role present in the run
+        """
+        groups, group_index = np.unique(np.char.add(np.char.add(self.movements(trips), "|"), self.roles(trips)),
+                                        return_inverse=True)
+        number_groups = len(groups)
+        rows = dict(run=np.full(number_groups, entry["source"]),
+                    freq_1=np.full(number_groups, float(entry["traffic_level_1"])),
+                    freq_3=np.full(number_groups, float(entry["traffic_level_3"])),
+                    prob_1=np.full(number_groups, float(entry["deceiving_level_1"])),
+                    prob_3=np.full(number_groups, float(entry["deceiving_level_3"])),
+                    movement=np.array([group.split("|")[0] for group in groups]),
+                    role=np.array([group.split("|")[1] for group in groups]),
+                    count=np.bincount(group_index, minlength=number_groups))
+        for measure in self.MEASURES:
+            values = trips[measure]
+            rows[f"{measure}_sum"] = np.bincount(group_index, weights=values, minlength=number_groups)
+            rows[f"{measure}_sum_squares"] = np.bincount(group_index, weights=values ** 2, minlength=number_groups)
+            rows[f"{measure}_min"] = np.full(number_groups, np.inf)
+            np.minimum.at(rows[f"{measure}_min"], group_index, values)
+            rows[f"{measure}_max"] = np.full(number_groups, -np.inf)
+            np.maximum.at(rows[f"{measure}_max"], group_index, values)
+            histogram = np.zeros((number_groups, self.bins), dtype=np.int32)
+            bins = np.clip((values / self.BIN_SECONDS).astype(int), 0, self.bins - 1)
+            np.add.at(histogram, (group_index, bins), 1)
+            rows[f"{measure}_histogram"] = histogram
+        return rows
+
+    def update(self, entries):
+        """Replaces the rows of the runs given with their current trips and saves the cube
+
+        Args:
+            entries (list of dict): Entries of the manifest of the ResultStore of the runs, eg: the ones returned by
+                ResultStore.ingest
+        """
+        if len(entries) == 0:
+            return
+        kept = ~np.isin(self.rows["run"], [entry["source"] for entry in entries])
+        parts = [{name: values[kept] for name, values in self.rows.items()}]
+        for entry in entries:
+            parts.append(self.run_rows(entry, ResultStore.read_partition(entry["partition"])))
+        self.rows = {name: np.concatenate([part[name] for part in parts]) for name in self.rows}
+        self.save()
+
+    def slice(self, by=("freq_1", "freq_3", "prob_1", "prob_3"), measure="duration", quantiles=(), **filters):
+        """Aggregates of the trips grouped by some of the keys
+
+        Args:
+            by (tuple of str, optional): Keys to group by, see KEYS. Defaults to the swept parameters.
+            measure (str, optional): Measure to aggregate, see MEASURES. Defaults to "duration".
+            quantiles (tuple of float, optional): Quantiles of the measure to estimate from the histograms, eg: 0.5
+                for the median. Defaults to none.
+            filters: Value of the keys to consider, a list or tuple for several values, eg: role="deceiver"
+
+        Returns:
+            dict: numpy array indexed by name with one value per group: the keys grouped by, count, mean, std,
+                min, max and q<quantile> for each quantile
+        """
+        selected = np.ones(len(self.rows["count"]), dtype=bool)
+        for key, value in filters.items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            selected &= np.isin(self.rows[key], values)
+        rows = {name: values[selected] for name, values in self.rows.items()}
+
+        groups = dict()
+        group_index = np.array([groups.setdefault(group, len(groups))
+                                for group in zip(*(rows[key].tolist() for key in by))], dtype=int)
+        number_groups = len(groups)
+        count = np.bincount(group_index, weights=rows["count"], minlength=number_groups)
+        total = np.bincount(group_index, weights=rows[f"{measure}_sum"], minlength=number_groups)
+        squares = np.bincount(group_index, weights=rows[f"{measure}_sum_squares"], minlength=number_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            variance = (squares - count * mean ** 2) / (count - 1)
+        result = {key: np.array([group[i] for group in groups]) for i, key in enumerate(by)}
+        result.update(count=count.astype(np.int64), mean=mean, std=np.sqrt(np.maximum(variance, 0)))
+        result["min"] = np.full(number_groups, np.inf)
+        np.minimum.at(result["min"], group_index, rows[f"{measure}_min"])
+        result["max"] = np.full(number_groups, -np.inf)
+        np.maximum.at(result["max"], group_index, rows[f"{measure}_max"])
+        if len(quantiles) > 0:
+            histogram = np.zeros((number_groups, self.bins), dtype=np.int64)
+            np.add.at(histogram, group_index, rows[f"{measure}_histogram"])
+            cumulative = np.cumsum(histogram, axis=1)
+            for quantile in quantiles:
+                # Middle of the first bin reaching the quantile
+                bins = np.argmax(cumulative >= quantile * cumulative[:, -1:], axis=1)
+                result[f"q{quantile}"] = np.where(count > 0, (bins + 0.5) * self.BIN_SECONDS, np.nan)
+        return result
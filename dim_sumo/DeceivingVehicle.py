@@ -1,7 +1,7 @@
 from Vehicle import Vehicle
 from SimStateAndConfig import SimStateAndConfig
 from Message import ResponseFollowerMessage
-import traci
+from SumoBackend import traci
 from Log import Log
 
 class DeceivingVehicle(Vehicle):
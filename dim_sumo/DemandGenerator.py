@@ -0,0 +1,248 @@
+import numpy as np
+
+
+def get_node_number(i, j, city_size):
+    if (i == 0 and j == 0) or (i == 0 and j == (city_size + 1)) or (i == (city_size + 1) and j == 0) or (
+            i == (city_size + 1) and j == (city_size + 1)):
+        return -1
+    if i == 0 or i == (city_size + 1):
+        node = city_size * (city_size + 2) + 2 * (j - 1) + 1 + (i != 0)
+    else:
+        node = (i - 1) * (city_size + 2) + 1 + j
+    return node
+
+
+class DemandGenerator:
+    """Generates the vehicles of the route files of the cities.
+
+    Instead of deciding second by second whether each route gets a vehicle, all the departures of a route are drawn
+    at once with numpy, the roles (emergency, flaw, deceiver) are assigned to whole arrays and the vehicles are
+    written in large chunks. The arrivals of each route can be Bernoulli (at most one vehicle per second, the
+    classic behaviour) or Poisson, and their rate can change over time with a profile.
+
+    The demand can also be written as flows, letting sumo draw the vehicles while it loads them. The route files are
+    then a few KB no matter how long the demand is, the ids of the vehicles of a flow are the id of the flow followed
+    by a dot and a number, so they keep the suffix of their role.
+    """
+
+    # Increase it whenever the same parameters generate different vehicles
+    VERSION = 1
+    ARRIVALS = ("bernoulli", "poisson")
+    # Roles of the vehicles, the suffix of their id tells the simulation which kind of vehicle to create
+    REGULAR, EMERGENCY, FLAW, DECEIVER = range(4)
+    SUFFIXES = ("", "_emergency", "_flaw", "_dec")
+    COLORS = ("yellow", "red", "blue", "yellow")
+    VEHICLE_TYPE = '<vType id="Car" length="5.00" minGap="2.50" maxSpeed="16.67" guiShape="passenger" carFollowModel="IDM" accel="0.8" decel="4.5" tau="1.0"/>'
+
+    def __init__(self, city_size=2, seconds=3600, arrivals="bernoulli", profile=None, seed=12, chunk_size=20000,
+                 flow_interval_seconds=300):
+        """
+        Args:
+            city_size (int, optional): Number of streets in each direction of the city. Defaults to 2.
+            seconds (int, optional): Number of seconds to introduce vehicles. Defaults to 3600 (an hour).
+            arrivals (str, optional): Distribution of the vehicles entering each route in a second, "bernoulli" or
+                "poisson". Defaults to "bernoulli".
+            profile (callable or array, optional): Factor of the rates in each second, either an array with one
+                value per second or a function that receives the array of seconds. Defaults to None (constant rates).
+            seed (int, optional): Seed of the random generator. Defaults to 12 to make tests reproducible.
+            chunk_size (int, optional): Number of vehicles written to the file at once. Defaults to 20000.
+            flow_interval_seconds (int, optional): Duration of the flows when there is a profile, the profile is
+                averaged over each of them. Defaults to 300.
+        """
+        if arrivals not in self.ARRIVALS:
+            raise ValueError(f"Unknown arrivals {arrivals}, use one of {self.ARRIVALS}")
+        self.city_size = city_size
+        self.seconds = seconds
+        self.arrivals = arrivals
+        self.profile = profile
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.flow_interval_seconds = flow_interval_seconds
+
+    def routes(self):
+        """Edges of each route of the city
+
+        Returns:
+            dict: list of edge ids indexed by route id, in the order they are written
+        """
+        city_size = self.city_size
+        routes = dict()
+        for i in range(1, city_size + 1, 2):
+            id_route = str((i + 1) // 2)
+            edges = [f"{get_node_number(i, j, city_size)}to{get_node_number(i, j + 1, city_size)}" for j in range(city_size)]
+            routes["right" + id_route] = edges + ["outr" + id_route]
+        for i in range(2, city_size + 1, 2):
+            id_route = str(i // 2)
+            edges = [f"{get_node_number(i, j + 1, city_size)}to{get_node_number(i, j, city_size)}" for j in range(city_size, 0, -1)]
+            routes["left" + id_route] = edges + ["outl" + id_route]
+        for j in range(1, city_size + 1, 2):
+            id_route = str((j + 1) // 2)
+            edges = [f"{get_node_number(i, j, city_size)}to{get_node_number(i + 1, j, city_size)}" for i in range(city_size)]
+            routes["down" + id_route] = edges + ["outs" + id_route]
+        for j in range(2, city_size + 1, 2):
+            id_route = str(j // 2)
+            edges = [f"{get_node_number(i + 1, j, city_size)}to{get_node_number(i, j, city_size)}" for i in range(city_size, 0, -1)]
+            routes["up" + id_route] = edges + ["outn" + id_route]
+        return routes
+
+    def route_rates(self, pWE, pNS, pSN, pEW, dWE, dNS):
+        """Rate of vehicles and fraction of deceivers of each route, in the order the vehicles of a second depart
+
+        Returns:
+            list of (str, float, float): route id, expected vehicles per second and fraction of deceivers
+        """
+        mid_size = (self.city_size + 1) // 2
+        return ([(f"right{j + 1}", pWE, dWE) for j in range(mid_size)]
+                + [(f"down{j + 1}", pNS, dNS) for j in range(mid_size)]
+                + [(f"up{j + 1}", pSN, 0.0) for j in range(self.city_size - mid_size)]
+                + [(f"left{j + 1}", pEW, 0.0) for j in range(self.city_size - mid_size)])
+
+    def special_routes(self):
+        """Routes the emergency and flawed vehicles are randomly assigned to"""
+        mid_size = (self.city_size + 1) // 2
+        routes = []
+        for i in range(mid_size):
+            routes += [f"right{i + 1}", f"down{i + 1}"]
+        for i in range(self.city_size - mid_size):
+            routes += [f"left{i + 1}", f"up{i + 1}"]
+        return routes
+
+    def intensity(self):
+        """Factor of the rates in each second"""
+        if self.profile is None:
+            return np.ones(self.seconds)
+        profile = self.profile(np.arange(self.seconds)) if callable(self.profile) else self.profile
+        return np.broadcast_to(np.asarray(profile, dtype=float), (self.seconds,))
+
+    def _departures(self, rng, rate, intensity):
+        """Seconds in which vehicles depart with the given rate, repeated if several depart in the same second"""
+        rates = rate * intensity
+        if self.arrivals == "bernoulli":
+            return np.flatnonzero(rng.random(self.seconds) < rates)
+        return np.repeat(np.arange(self.seconds), rng.poisson(np.maximum(rates, 0)))
+
+    def draw(self, pWE=0.1, pNS=0.1, pSN=0.1, pEW=0.1, dWE=0.0, dNS=0.0, pEmergency=0.01, pFlaw=0.01):
+        """Draws the vehicles of the demand, see runner.generate_routefile for the parameters
+
+        Returns:
+            (list of str, np.ndarray, np.ndarray, np.ndarray): route ids, and departure second, route index and role
+                of each vehicle sorted by departure
+        """
+        rng = np.random.default_rng(self.seed)
+        intensity = self.intensity()
+        rates = self.route_rates(pWE, pNS, pSN, pEW, dWE, dNS)
+        route_ids = [route for route, _, _ in rates]
+        departs, route_indexes, roles, order = [], [], [], []
+
+        # The emergency and flawed vehicles depart first in their second, never both in the same one
+        emergency = self._departures(rng, pEmergency, intensity)
+        flaw = self._departures(rng, pFlaw, intensity)
+        flaw = flaw[~np.isin(flaw, emergency)]
+        special_routes = np.array([route_ids.index(route) for route in self.special_routes()])
+        for role, seconds in ((self.EMERGENCY, emergency), (self.FLAW, flaw)):
+            departs.append(seconds)
+            route_indexes.append(special_routes[rng.integers(0, len(special_routes), len(seconds))])
+            roles.append(np.full(len(seconds), role))
+            order.append(np.zeros(len(seconds), dtype=int))
+
+        for index, (_, rate, deceivers) in enumerate(rates):
+            seconds = self._departures(rng, rate, intensity)
+            departs.append(seconds)
+            route_indexes.append(np.full(len(seconds), index))
+            roles.append(np.where(rng.random(len(seconds)) < deceivers, self.DECEIVER, self.REGULAR))
+            order.append(np.full(len(seconds), index + 1))
+
+        departs = np.concatenate(departs)
+        route_indexes = np.concatenate(route_indexes)
+        roles = np.concatenate(roles)
+        # Within a second the vehicles keep the order of the routes
+        sorted_indexes = np.lexsort((np.concatenate(order), departs))
+        return route_ids, departs[sorted_indexes], route_indexes[sorted_indexes], roles[sorted_indexes]
+
+    def write(self, routefile, **demand):
+        """Writes the route file with the vehicles of the demand
+
+        Args:
+            routefile (str): Path of the route file
+            demand: Rates of the vehicles, see draw
+
+        Returns:
+            dict: number of vehicles of each route, and the total of vehicles, emergency, flawed and deceivers
+        """
+        route_ids, departs, route_indexes, roles = self.draw(**demand)
+        with open(routefile, "w", buffering=1 << 20) as routes:
+            routes.write(f"<routes>\n    {self.VEHICLE_TYPE}\n")
+            for route, edges in self.routes().items():
+                routes.write(f'    <route id="{route}" edges="{" ".join(edges)}" />\n')
+            for chunk in self._vehicle_chunks(route_ids, departs, route_indexes, roles):
+                routes.write(chunk)
+            routes.write("</routes>\n")
+
+        counts = dict(zip(route_ids, np.bincount(route_indexes, minlength=len(route_ids)).tolist()))
+        role_counts = np.bincount(roles, minlength=len(self.SUFFIXES))
+        counts.update(total=len(departs), emergency=int(role_counts[self.EMERGENCY]),
+                      flaw=int(role_counts[self.FLAW]), deceivers=int(role_counts[self.DECEIVER]))
+        return counts
+
+    def flows(self, pWE=0.1, pNS=0.1, pSN=0.1, pEW=0.1, dWE=0.0, dNS=0.0, pEmergency=0.01, pFlaw=0.01):
+        """Flows with the same expected demand as draw, one per route, role and interval of the profile. The
+        emergency and flawed vehicles are spread evenly among their routes.
+
+        Only the expected demand matches draw, not its guarantees. The role of a vehicle is the suffix of its id, so a
+        flow can't mix roles and each role of a route gets its own independent flow: with Bernoulli arrivals a route
+        with deceivers can emit a regular vehicle and a deceiver in the same second, a special route can emit an
+        emergency or flawed vehicle along with a regular one, and an emergency and a flawed vehicle can depart in the
+        same second. These coincidences are rare while the rates are low, use the vehicles output when they matter.
+
+        Returns:
+            list of (str, str, int, int, int, float): id, route, role, begin, end and expected vehicles per second of
+                each flow sorted by begin
+        """
+        intensity = self.intensity()
+        rates = self.route_rates(pWE, pNS, pSN, pEW, dWE, dNS)
+        special_routes = self.special_routes()
+        interval_seconds = self.seconds if self.profile is None else self.flow_interval_seconds
+        flows = []
+        for interval, begin in enumerate(range(0, self.seconds, interval_seconds)):
+            end = min(begin + interval_seconds, self.seconds)
+            factor = float(intensity[begin:end].mean())
+            roles = [(route, self.EMERGENCY, pEmergency / len(special_routes)) for route in special_routes]
+            roles += [(route, self.FLAW, pFlaw * (1 - pEmergency) / len(special_routes)) for route in special_routes]
+            for route, rate, deceivers in rates:
+                roles += [(route, self.REGULAR, rate * (1 - deceivers)), (route, self.DECEIVER, rate * deceivers)]
+            flows += [(f"{route}_{interval}{self.SUFFIXES[role]}", route, role, begin, end, rate * factor)
+                      for route, role, rate in roles if rate * factor > 0]
+        return flows
+
+    def write_flows(self, routefile, **demand):
+        """Writes the route file with flows instead of vehicles, see flows. The vehicles are drawn by sumo with its
+        own random generator, see its --seed option. Unlike write, it doesn't guarantee at most one vehicle per route
+        and second, see flows.
+
+        Args:
+            routefile (str): Path of the route file
+            demand: Rates of the vehicles, see draw
+
+        Returns:
+            dict: number of flows and of vehicles expected
+        """
+        flows = self.flows(**demand)
+        with open(routefile, "w") as routes:
+            routes.write(f"<routes>\n    {self.VEHICLE_TYPE}\n")
+            for route, edges in self.routes().items():
+                routes.write(f'    <route id="{route}" edges="{" ".join(edges)}" />\n')
+            for flow_id, route, role, begin, end, rate in flows:
+                # A Bernoulli trial per second or exponential times between vehicles for Poisson arrivals
+                frequency = f'probability="{min(rate, 1.0)}"' if self.arrivals == "bernoulli" else f'period="exp({rate})"'
+                routes.write(f'    <flow id="{flow_id}" type="Car" color="{self.COLORS[role]}" route="{route}" departSpeed="desired" begin="{begin}" end="{end}" {frequency} />\n')
+            routes.write("</routes>\n")
+        return dict(flows=len(flows), expected=sum(rate * (end - begin) for *_, begin, end, rate in flows))
+
+    def _vehicle_chunks(self, route_ids, departs, route_indexes, roles):
+        """Lines of the vehicles joined in chunks of chunk_size vehicles"""
+        for start in range(0, len(departs), self.chunk_size):
+            end = min(start + self.chunk_size, len(departs))
+            yield "".join(
+                f'    <vehicle id="{route_ids[route]}_{number}{self.SUFFIXES[role]}" type="Car" color="{self.COLORS[role]}" route="{route_ids[route]}" departSpeed="desired" depart="{depart}" />\n'
+                for number, depart, route, role in zip(range(start, end), departs[start:end].tolist(),
+                                                       route_indexes[start:end].tolist(), roles[start:end].tolist()))
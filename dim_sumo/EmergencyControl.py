@@ -1,15 +1,10 @@
-import xml.etree.ElementTree as ET
+from TripinfoReader import TripinfoReader
 from utils import mean_confidence_interval
 
-tree = ET.parse('data/out-tripinfo.xml')
-root = tree.getroot()
+trips = TripinfoReader.read('data/out-tripinfo.xml')
 
-list_emergency_times = []
-list_total_times = []
-for tripinfo in root:
-    if "emergency" in tripinfo.attrib.get("id"):
-        list_emergency_times.append(float(tripinfo.attrib.get("waitingTime")))
-    list_total_times.append(float(tripinfo.attrib.get("waitingTime")))
+list_emergency_times = trips["waitingTime"][trips["is_emergency"]]
+list_total_times = trips["waitingTime"]
 
 if len(list_emergency_times) > 0:
     print("Promedio de tiempo de espera en segundos para los carros de prioridad: ", mean_confidence_interval(list_emergency_times))
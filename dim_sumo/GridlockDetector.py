@@ -0,0 +1,121 @@
+import math
+from collections import deque
+from SumoBackend import traci
+from Vehicle import Vehicle_State
+from SimStateAndConfig import SimStateAndConfig
+
+
+class GridlockError(RuntimeError):
+    """Raised when a run is aborted because it got stuck, so it is not mistaken for a valid data point"""
+
+    def __init__(self, gridlock):
+        """
+        Args:
+            gridlock (dict): Description of the gridlock, see GridlockDetector.step
+        """
+        super().__init__(f"The simulation got stuck in a gridlock: {gridlock}")
+        self.gridlock = gridlock
+
+
+class GridlockDetector:
+    """Detects simulations stuck in a state they can not leave by themselves, so they can be aborted.
+
+    A simulation is considered in gridlock when no vehicle has arrived during a whole window while there are
+    vehicles in the network and either the leaders near the intersections are all stopped or some of them are
+    yielding to each other in a cycle. The leaders are only inspected once the window is empty of arrivals.
+    """
+
+    # Speed under which a vehicle is considered stopped, the same threshold sumo uses for the waiting time
+    STOPPED_SPEED = 0.1
+
+    def __init__(self, lanes, step_length, config : SimStateAndConfig):
+        """
+        Args:
+            lanes (dict): Lanes of the simulation indexed by id
+            step_length (double): Duration of a simulation step in seconds
+            config (SimStateAndConfig): Configuration of the simulation, see gridlock_window_seconds
+        """
+        self.lanes = lanes
+        self.step_length = step_length
+        self.config = config
+        self.arrivals = deque()
+        self.arrivals_in_window = 0
+        self.next_inspection_step = 0
+
+    def step(self, current_step):
+        """Updates the detector with the last simulation step
+
+        Returns:
+            dict: description of the gridlock or None if the simulation is not stuck
+        """
+        if self.config.gridlock_window_seconds is None:
+            return None
+        window_steps = math.ceil(self.config.gridlock_window_seconds / self.step_length)
+        arrived = len(self.config.vehicle_states.arrived_ids)
+        self.arrivals.append(arrived)
+        self.arrivals_in_window += arrived
+        while len(self.arrivals) > window_steps:
+            self.arrivals_in_window -= self.arrivals.popleft()
+
+        if (len(self.arrivals) < window_steps or self.arrivals_in_window > 0
+                or current_step < self.next_inspection_step or len(self.config.lane_occupancy.vehicle_lane_ids) == 0):
+            return None
+        gridlock = self.inspect_leaders(current_step)
+        if gridlock is None:
+            # The vehicles are moving somewhere, do not inspect them again in every step
+            self.next_inspection_step = current_step + max(1, window_steps // 10)
+        return gridlock
+
+    def inspect_leaders(self, current_step):
+        leaders = [lane.vehicles[0] for lane in self.lanes.values() if len(lane.vehicles) > 0]
+        for leader in leaders:
+            leader.refresh_position()
+        near = [leader for leader in leaders
+                if leader.distance_to_intersection < self.config.start_negotiating_at_distance_from_intersection]
+        stopped = [leader for leader in near if leader.speed < self.STOPPED_SPEED]
+
+        cycle = self._yield_cycle(stopped)
+        if cycle is not None:
+            return self._describe(current_step, "yield_cycle", cycle)
+        if len(near) > 0 and len(stopped) == len(near):
+            # Report the intersection with more vehicles stuck
+            by_junction = dict()
+            for leader in stopped:
+                by_junction.setdefault(self._junction(leader), []).append(leader)
+            return self._describe(current_step, "stopped_leaders", max(by_junction.values(), key=len))
+        return None
+
+    def _yield_cycle(self, stopped):
+        """Finds stopped leaders waiting for each other, following who each one negotiated with"""
+        waiting = {leader.id: leader for leader in stopped
+                   if leader.state in (Vehicle_State.YIELDING, Vehicle_State.WAITING)}
+        visited = set()
+        for start in waiting.values():
+            path = []
+            current = start
+            while current is not None and current.id not in visited:
+                visited.add(current.id)
+                path.append(current)
+                other = current.negotiating_with
+                # The vehicle negotiated with may be an older object of a leader, look it up by id
+                current = None if other is None else waiting.get(other.id)
+            if current is not None and current in path:
+                return path[path.index(current):]
+        return None
+
+    def _junction(self, vehicle):
+        try:
+            return traci.edge.getToJunction(vehicle.lane.edge_id)
+        except traci.TraCIException:
+            return vehicle.lane.edge_id
+
+    def _describe(self, current_step, reason, leaders):
+        return dict(status="gridlock", reason=reason, step=current_step,
+                    time=self.config.current_time_seconds, window_seconds=self.config.gridlock_window_seconds,
+                    vehicles_left=len(self.config.lane_occupancy.vehicle_lane_ids),
+                    junction=self._junction(leaders[0]),
+                    leaders=[dict(id=leader.id, lane=leader.lane.id, state=leader.state.name, speed=leader.speed,
+                                  distance_to_intersection=leader.distance_to_intersection,
+                                  negotiating_with=None if leader.negotiating_with is None else leader.negotiating_with.id,
+                                  yield_time=leader._yield_time())
+                             for leader in leaders])
@@ -1,9 +1,9 @@
-import traci
+import bisect
+from SumoBackend import traci
 import numpy as np
 from Vehicle import Vehicle
-from EmergencyVehicle import EmergencyVehicle
-from FlawVehicle import FlawVehicle
 from SimStateAndConfig import SimStateAndConfig
+from LaneSpatialIndex import LaneSpatialIndex
 from Log import Log
 
 class Lane:
@@ -13,27 +13,70 @@ class Lane:
         self.id = id
         self.lane_length = lane_length
         self.log = Log(config)
-        self.vehicles = []
-        self.vehicle_ids = []
-        self.current_step = 0
         self.shape = list(np.array(xy) for xy in traci.lane.getShape(self.id)) # Convert each of the points in the shape to numpy arrays
+        self.shape_points = np.array(self.shape) # The same points as rows of an array, to measure them all at once
         self.edge_id = traci.lane.getEdgeID(self.id)
+        self.max_speed = traci.lane.getMaxSpeed(self.id)
         self.adjacent_lanes = list() # Will have and entry for each of the points in the shape with the nearby lanes
-        # Indicates the last step in which all vehicles in the lane have had their positions updated
-        self.updated_in_step = 0
+        self.next_lanes = list() # Same as adjacent_lanes but only with the lanes before or after this one
+        # Position along the lane where the segments between the points of the shape are split in half, used to find
+        # the point of the shape closest to a vehicle in this lane
+        self.shape_midpoints = list()
+        self.reset()
+
+    def reset(self):
+        """Forgets the vehicles of the current simulation keeping the geometry of the lane"""
+        # Vehicles in the lane ordered from the leader backwards, along with their ids and the position of each id
+        # in the lane for constant time membership and position lookups
+        self.vehicles = []
+        self.vehicle_ids = ()
+        self.vehicle_positions = dict()
+        # Position along the lane of the vehicles in the same order as reported by sumo, and their distances to the
+        # intersection, built from them the first time a step needs them, see vehicles_in_radius
+        self.vehicle_lane_positions = ()
+        self.vehicle_distances = None
+        self.current_step = 0
         self.convoy_cross = False
         self.last_vehicle_convoy = None
+        # Leader at the end of the last update, vehicles may leave the lane between updates, see remove_vehicle
+        self.last_leader = None
 
-    def find_adjacent_lanes(self, lanes):        
+    def find_adjacent_lanes(self, spatial_index : LaneSpatialIndex):
         # For each of the points in the shape look for adjacent lanes
         for p in self.shape:
             adjacent = list()
-            for lane in lanes:
-                if lane.id != self.id and lane.is_adjacent_to_point(p):
+            for lane in spatial_index.lanes_near(p, self.config.max_distance_between_adjacent_lanes):
+                if lane.id != self.id:
                     adjacent.append(lane)
             self.adjacent_lanes.append(adjacent)
         #self.log.info(self.id, " adjacent to ", self.adjacent_lanes)
 
+    def build_intersection_topology(self):
+        """Precomputes the lanes around each point of the shape that are before or after this lane and where each
+        point of the shape is along the lane, so the lookups done by the leaders in every step do not need geometry.
+        Must be called once all the lanes have found their adjacent lanes.
+        """
+        self.next_lanes = [[lane for lane in adjacent if self.is_previous_or_next_lane(lane)] for adjacent in self.adjacent_lanes]
+        segment_lengths = [np.linalg.norm(self.shape[i + 1] - self.shape[i]) for i in range(len(self.shape) - 1)]
+        scale = self.lane_length / sum(segment_lengths) if sum(segment_lengths) > 0 else 1
+        offsets = np.cumsum([0] + segment_lengths) * scale
+        self.shape_midpoints = [(offsets[i] + offsets[i + 1]) / 2 for i in range(len(offsets) - 1)]
+
+    def closest_shape_point(self, vehicle):
+        """Finds the point of the shape closest to a vehicle
+
+        Args:
+            vehicle (Vehicle): Vehicle to compare
+
+        Returns:
+            int: index of the closest point in the shape
+        """
+        if vehicle.lane is self:
+            # Vehicles in this lane are located by their position along the lane
+            return bisect.bisect_left(self.shape_midpoints, vehicle.lane_position)
+        distances = np.hypot(self.shape_points[:, 0] - vehicle.position[0], self.shape_points[:, 1] - vehicle.position[1])
+        return int(np.argmin(distances))
+
     def is_previous_or_next_lane(self, lane):
         ans = False
         for p in self.shape:
@@ -47,41 +90,96 @@ class Lane:
         return False
 
     def step(self, current_step, traffic_lights) -> bool:
+        leader_changed = self.update_vehicles(current_step)
+        # Give the leading vehicle a chance to comunicate with other vehicles
+        if not traffic_lights:
+            self.step_leader()
+        return leader_changed
+
+    def update_vehicles(self, current_step) -> bool:
+        """Updates the vehicles in the lane with the ones reported by SUMO in this step
+
+        Returns:
+            bool: True if the leader of the lane changed
+        """
         # Keep track of the current step
         self.current_step = current_step
         # Find the id of the vehicles in the lane
-        vehicle_ids = traci.lane.getLastStepVehicleIDs(self.id)
-        # Create a vehicle object for each of the vehicles in the lane if they don't exist
-        for vehicle_id in vehicle_ids:
-            if vehicle_id not in self.vehicle_ids:
-                # Determine the type of vehicle to insert in the simulation
-                vehicle_class = EmergencyVehicle if "_emergency" in vehicle_id else Vehicle
-                vehicle_class = FlawVehicle if "_flaw" in vehicle_id else vehicle_class
-                # Create the vehicle and add it to the lane along with its id for performance reasons
-                self.vehicles.append(vehicle_class(vehicle_id, self, self.config))
-                self.vehicle_ids.append(vehicle_id)
-
-        # Remove the leading vehicle if it is no longer in the lane
-        if len(self.vehicles) > 0 and self.vehicles[0].id not in vehicle_ids:
-            self.vehicles.pop(0)
-            self.vehicle_ids.pop(0)
+        vehicle_ids = self.config.lane_occupancy.vehicle_ids(self.id)
+        if vehicle_ids != self.vehicle_ids:
+            # Rebuild the lane in one pass in the order reported by sumo, dropping every vehicle that left. The
+            # vehicles that just entered keep their object from the lanes they come from
+            vehicles = self.vehicles
+            positions = self.vehicle_positions
+            registry = self.config.vehicle_registry
+            self._set_vehicles([vehicles[positions[vehicle_id]] if vehicle_id in positions
+                                else registry.enter_lane(vehicle_id, self) for vehicle_id in vehicle_ids])
+        # The positions change in every step even if the vehicles in the lane do not
+        self.vehicle_lane_positions = self.config.lane_occupancy.positions(self.id)
+        self.vehicle_distances = None
+
+        previous_leader = self.last_leader
+        self.last_leader = self.vehicles[0] if len(self.vehicles) > 0 else None
+        return self.last_leader is not previous_leader
+
+    def _set_vehicles(self, vehicles):
+        self.vehicles = vehicles
+        self.vehicle_ids = tuple(vehicle.id for vehicle in vehicles)
+        self.vehicle_positions = {vehicle_id: i for i, vehicle_id in enumerate(self.vehicle_ids)}
+        self.vehicle_distances = None
+
+    def remove_vehicle(self, vehicle):
+        """Removes a vehicle that moved to another lane if it is still in this one"""
+        if vehicle.id in self.vehicle_positions:
+            index = self.vehicle_positions[vehicle.id]
+            self.vehicle_lane_positions = self.vehicle_lane_positions[:index] + self.vehicle_lane_positions[index + 1:]
+            self._set_vehicles([v for v in self.vehicles if v is not vehicle])
+
+    def distances_to_intersection(self):
+        """Distances to the intersection of the vehicles in the lane in this step
+
+        Returns:
+            numpy array: one distance per vehicle in the same order as vehicles, so they are increasing
+        """
+        if self.vehicle_distances is None:
+            self.vehicle_distances = self.lane_length - np.array(self.vehicle_lane_positions, dtype=float)
+        return self.vehicle_distances
 
-        # Give the leading vehicle a chance to comunicate with other vehicles
-        if not traffic_lights:
-            if len(self.vehicles) > 0:
-                self.vehicles[0].step_leader(self)
+    def vehicles_in_radius(self, distance_to_intersection, radius):
+        """Vehicles of the lane within a distance along the lane from a point of it
+
+        Args:
+            distance_to_intersection (double): Distance from the point to the intersection
+            radius (double): Max distance along the lane between the point and the vehicles
+
+        Returns:
+            list of Vehicle: the vehicles in the radius, ordered from the leader backwards
+        """
+        distances = self.distances_to_intersection()
+        first = np.searchsorted(distances, distance_to_intersection - radius, side="left")
+        last = np.searchsorted(distances, distance_to_intersection + radius, side="right")
+        return self.vehicles[first:last]
+
+    def step_leader(self):
+        """Gives the leading vehicle a chance to comunicate with other vehicles
+
+        Returns:
+            Vehicle: the leader of the lane or None if the lane is empty
+        """
+        if len(self.vehicles) == 0:
+            return None
+        self.vehicles[0].step_leader(self)
+        return self.vehicles[0]
 
     def send_message_in_radius(self, message, radius):
-        # Before sending the message make sure all vehicles in the lane are up to date
-        if self.updated_in_step < self.current_step:
-            for vehicle in self.vehicles:
-                vehicle.refresh_position()
-            self.updated_in_step = self.current_step
+        # The sender is in this lane and the lanes are straight, so the vehicles in the radius are the ones within
+        # that distance along the lane. Each of them refreshes its position when processing the message
+        message.sender.refresh_position()
 
         # Send the message to all the vehicles in the radius ignoring the sender
         responses = list()
-        for vehicle in self.vehicles:
-            if vehicle != message.sender and vehicle.distance_to_vehicle(message.sender) <= radius and not vehicle.is_flaw:
+        for vehicle in self.vehicles_in_radius(message.sender.distance_to_intersection, radius):
+            if vehicle != message.sender and not vehicle.is_flaw:
                 responses.append(vehicle.process_message(message))
 
         self.log.info("Leader: ", message.sender.id, " , respuestas recibidas: ", responses)
@@ -90,13 +188,7 @@ class Lane:
 
     def send_message_opposite_leader_in_radius(self, message, radius):
         # Find the endpoing closest to the sender
-        min_index = 0
-        min_distance = message.sender.distance_to_point(self.shape[0])
-        for i in range(1, len(self.shape)):
-            distance = message.sender.distance_to_point(self.shape[i])
-            if distance < min_distance:
-                min_index = i
-                min_distance = distance
+        min_index = self.closest_shape_point(message.sender)
         
         # Send the message to the leaders in lanes that are opposite to the endpoint found
         responses = list()
@@ -111,23 +203,16 @@ class Lane:
 
     def send_message_next_last_follower_in_radius(self, message, radius):
         # Find the endpoing closest to the sender
-        min_index = 0
-        min_distance = message.sender.distance_to_point(self.shape[0])
-        for i in range(1, len(self.shape)):
-            distance = message.sender.distance_to_point(self.shape[i])
-            if distance < min_distance:
-                min_index = i
-                min_distance = distance
+        min_index = self.closest_shape_point(message.sender)
 
         # Send the message to the leaders in lanes that are opposite to the endpoint found
         responses = list()
         if message.sender.id == 'left2_878':
             print("Voy a fallar")
-        for opposite_lane in self.adjacent_lanes[min_index]:
-            if self.is_previous_or_next_lane(opposite_lane):
-                response = opposite_lane.send_message_to_last_follower_in_radius(message, radius)
-                if response is not None:
-                    responses.append(response)
+        for opposite_lane in self.next_lanes[min_index]:
+            response = opposite_lane.send_message_to_last_follower_in_radius(message, radius)
+            if response is not None:
+                responses.append(response)
 
         # self.log.info(message.sender.id, " , mensajes: ", responses)
 
@@ -135,13 +220,7 @@ class Lane:
 
     def send_perception_opposite_leader_in_radius(self, message, radius):
         # Find the endpoing closest to the sender
-        min_index = 0
-        min_distance = message.sender.distance_to_point(self.shape[0])
-        for i in range(1, len(self.shape)):
-            distance = message.sender.distance_to_point(self.shape[i])
-            if distance < min_distance:
-                min_index = i
-                min_distance = distance
+        min_index = self.closest_shape_point(message.sender)
 
         # Send the message to the leaders in lanes that are opposite to the endpoint found
         responses = list()
@@ -156,21 +235,14 @@ class Lane:
 
     def send_perception_next_last_follower_in_radius(self, message, radius):
         # Find the endpoing closest to the sender
-        min_index = 0
-        min_distance = message.sender.distance_to_point(self.shape[0])
-        for i in range(1, len(self.shape)):
-            distance = message.sender.distance_to_point(self.shape[i])
-            if distance < min_distance:
-                min_index = i
-                min_distance = distance
+        min_index = self.closest_shape_point(message.sender)
 
         # Send the message to the leaders in lanes that are opposite to the endpoint found
         responses = list()
-        for opposite_lane in self.adjacent_lanes[min_index]:
-            if self.is_previous_or_next_lane(opposite_lane):
-                response = opposite_lane.send_perception_to_last_follower_in_radius(message, radius)
-                if response is not None:
-                    responses.append(response)
+        for opposite_lane in self.next_lanes[min_index]:
+            response = opposite_lane.send_perception_to_last_follower_in_radius(message, radius)
+            if response is not None:
+                responses.append(response)
 
         # self.log.info(message.sender.id, " , mensajes: ", responses)
 
@@ -237,9 +309,11 @@ class Lane:
             relaying_vehicle (Vehicle): Vehicle that is relaying the message
             radius (double): Max distance between the vehicles to perform the relaying
         """
-        relay_to_index = self.vehicles.index(relaying_vehicle) + 1
-        if relay_to_index < len(self.vehicles) and relaying_vehicle.distance_to_vehicle(self.vehicles[relay_to_index]) <= radius:
-            return self.vehicles[relay_to_index].process_message(message)
+        relay_to_index = self.vehicle_positions[relaying_vehicle.id] + 1
+        if relay_to_index < len(self.vehicles):
+            distances = self.distances_to_intersection()
+            if distances[relay_to_index] - distances[relay_to_index - 1] <= radius:
+                return self.vehicles[relay_to_index].process_message(message)
 
         return None
                 
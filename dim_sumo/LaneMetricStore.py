@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class LaneMetricStore:
+    """Time series of the metrics measured in each lane stored by columns.
+
+    Each metric is kept in a preallocated NumPy array with one row per step and one column per lane, the arrays
+    grow by chunks of rows so appending a step does not allocate memory most of the time.
+    """
+
+    def __init__(self, lane_ids, metrics, chunk_steps=2000, dtype=np.float32):
+        """
+        Args:
+            lane_ids (list of str): Ids of the lanes to measure, they define the columns of the arrays
+            metrics (list of str): Names of the metrics to store
+            chunk_steps (int, optional): Number of rows added each time the arrays are full. Defaults to 2000.
+            dtype (numpy dtype, optional): Type used to store the values. Defaults to np.float32.
+        """
+        self.lane_ids = list(lane_ids)
+        self.lane_index = {lane_id: i for i, lane_id in enumerate(self.lane_ids)}
+        self.chunk_steps = chunk_steps
+        self.steps = 0
+        self.data = {metric: np.zeros((chunk_steps, len(self.lane_ids)), dtype=dtype) for metric in metrics}
+
+    def append(self, **rows):
+        """Adds the values of one step
+
+        Args:
+            rows: One array per metric with the value of each lane in the order of lane_ids
+        """
+        if self.steps == self.capacity():
+            self._grow()
+        for metric, row in rows.items():
+            self.data[metric][self.steps] = row
+        self.steps += 1
+
+    def capacity(self):
+        return next(iter(self.data.values())).shape[0] if len(self.data) > 0 else 0
+
+    def _grow(self):
+        for metric, values in self.data.items():
+            grown = np.zeros((values.shape[0] + self.chunk_steps, values.shape[1]), dtype=values.dtype)
+            grown[:values.shape[0]] = values
+            self.data[metric] = grown
+
+    def series(self, metric):
+        """Values of a metric for all the recorded steps, an array of shape (steps, lanes)"""
+        return self.data[metric][:self.steps]
+
+    def lane_series(self, metric, lane_id):
+        """Values of a metric in one lane for all the recorded steps"""
+        return self.data[metric][:self.steps, self.lane_index[lane_id]]
+
+    def last(self, metric):
+        """Values of a metric in all the lanes for the last recorded step"""
+        return self.data[metric][self.steps - 1]
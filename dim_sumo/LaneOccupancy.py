@@ -0,0 +1,95 @@
+import numpy as np
+from SumoBackend import traci
+import traci.constants as tc
+from SimStateAndConfig import SimStateAndConfig
+
+
+class LaneOccupancy:
+    """Snapshot of the vehicles in each lane for the current step built from context subscriptions.
+
+    Every junction of the network subscribes to the vehicles around it with a range that covers half of the longest
+    lane, so together they cover every lane and the occupancy of the whole network arrives in one batched response.
+    """
+
+    VARIABLES = (tc.VAR_LANE_ID, tc.VAR_LANEPOSITION, tc.VAR_SPEED)
+
+    def __init__(self, lane_lengths, config : SimStateAndConfig):
+        """
+        Args:
+            lane_lengths (dict): Length of each lane of the network indexed by lane id
+            config (SimStateAndConfig): Configuration of the simulation
+        """
+        self.config = config
+        self.lane_vehicle_ids = dict()
+        self.lane_speeds = dict()
+        self.lane_positions = dict()
+        self.vehicle_lane_ids = []
+        self.vehicle_speeds = []
+        # Any point of a lane is at most half its length away from one of its two junctions, the margin covers
+        # the size of the junctions and the lateral offset of the lanes
+        self.radius = max(lane_lengths.values()) / 2 + config.max_distance_between_adjacent_lanes
+        self.junction_ids = [j for j in traci.junction.getIDList() if not j.startswith(":")]
+        self.subscribe()
+
+    def subscribe(self):
+        """Subscribes to the vehicles around the junctions, needed again after loading a simulation or a state"""
+        for junction_id in self.junction_ids:
+            traci.junction.subscribeContext(junction_id, tc.CMD_GET_VEHICLE_VARIABLE, self.radius, self.VARIABLES)
+
+    def step(self):
+        """Rebuilds the occupancy of the lanes from the context subscription results of the last simulation step.
+        Must be called once after each traci.simulationStep()
+        """
+        # Junctions close to each other report the same vehicles, merge them by id
+        vehicles = dict()
+        for junction_results in traci.junction.getAllContextSubscriptionResults().values():
+            if junction_results:
+                vehicles.update(junction_results)
+
+        lanes = dict()
+        self.vehicle_lane_ids = [values[tc.VAR_LANE_ID] for values in vehicles.values()]
+        self.vehicle_speeds = [values[tc.VAR_SPEED] for values in vehicles.values()]
+        for vehicle_id, values in vehicles.items():
+            lanes.setdefault(values[tc.VAR_LANE_ID], []).append(
+                (values[tc.VAR_LANEPOSITION], vehicle_id, values[tc.VAR_SPEED]))
+
+        self.lane_vehicle_ids = dict()
+        self.lane_speeds = dict()
+        self.lane_positions = dict()
+        for lane_id, lane_vehicles in lanes.items():
+            # Order the vehicles from the front of the lane (the leader) to the back
+            lane_vehicles.sort(reverse=True)
+            self.lane_vehicle_ids[lane_id] = tuple(v[1] for v in lane_vehicles)
+            self.lane_speeds[lane_id] = [v[2] for v in lane_vehicles]
+            self.lane_positions[lane_id] = tuple(v[0] for v in lane_vehicles)
+
+    def vehicle_ids(self, lane_id):
+        """Ids of the vehicles in the lane ordered from the leader backwards"""
+        return self.lane_vehicle_ids.get(lane_id, ())
+
+    def speeds(self, lane_id):
+        """Speeds of the vehicles in the lane in the same order as vehicle_ids"""
+        return self.lane_speeds.get(lane_id, [])
+
+    def positions(self, lane_id):
+        """Positions along the lane of the vehicles in the lane in the same order as vehicle_ids"""
+        return self.lane_positions.get(lane_id, ())
+
+    def count(self, lane_id):
+        return len(self.lane_vehicle_ids.get(lane_id, ()))
+
+    def lane_totals(self, lane_index):
+        """Number of vehicles and sum of their speeds in a set of lanes
+
+        Args:
+            lane_index (dict): Position of each lane in the resulting arrays indexed by lane id
+
+        Returns:
+            (numpy array, numpy array): Number of vehicles and sum of the speeds of each lane
+        """
+        # Vehicles in lanes not in the index are counted in an extra position that is discarded
+        indexes = np.fromiter((lane_index.get(lane_id, len(lane_index)) for lane_id in self.vehicle_lane_ids),
+                              dtype=int, count=len(self.vehicle_lane_ids))
+        counts = np.bincount(indexes, minlength=len(lane_index) + 1)[:len(lane_index)]
+        speed_sums = np.bincount(indexes, weights=self.vehicle_speeds, minlength=len(lane_index) + 1)[:len(lane_index)]
+        return counts, speed_sums
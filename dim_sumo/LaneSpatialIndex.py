@@ -0,0 +1,45 @@
+import math
+import numpy as np
+
+
+class LaneSpatialIndex:
+    """Spatial hash of the shape points of a set of lanes.
+
+    The points are grouped in square cells of the size of the search distance, so the lanes close to a point are
+    found looking only at the points in the 9 cells around it instead of comparing against every lane.
+    """
+
+    def __init__(self, lanes, cell_size):
+        """
+        Args:
+            lanes (list of Lane): Lanes to index, the results keep the order of this list
+            cell_size (double): Size of the cells, must be at least the distance used in the searches
+        """
+        self.lanes = list(lanes)
+        self.cell_size = cell_size
+        self.cells = dict()
+        for order, lane in enumerate(self.lanes):
+            for point in lane.shape:
+                self.cells.setdefault(self._cell(point), []).append((order, point))
+
+    def _cell(self, point):
+        return math.floor(point[0] / self.cell_size), math.floor(point[1] / self.cell_size)
+
+    def lanes_near(self, point, max_distance):
+        """Finds the lanes that have a point of their shape closer than a given distance to a point
+
+        Args:
+            point (Numpy list of doubles (x, y)): point to search around
+            max_distance (double): distance to the point, can not be greater than the size of the cells
+
+        Returns:
+            list of Lane: lanes close to the point in the same order they were indexed
+        """
+        cell_x, cell_y = self._cell(point)
+        found = set()
+        for x in range(cell_x - 1, cell_x + 2):
+            for y in range(cell_y - 1, cell_y + 2):
+                for order, other in self.cells.get((x, y), ()):
+                    if order not in found and np.linalg.norm(other - point) < max_distance:
+                        found.add(order)
+        return [self.lanes[order] for order in sorted(found)]
@@ -0,0 +1,69 @@
+import heapq
+import math
+from Vehicle import Vehicle_State
+from SimStateAndConfig import SimStateAndConfig
+
+
+class NegotiationScheduler:
+    """Decides which lanes give their leader the chance to negotiate in each step.
+
+    Leaders only negotiate within start_negotiating_at_distance_from_intersection of the intersection, so a lane
+    whose leader is driving normally far from it is put to sleep until the earliest step in which the leader could
+    reach that zone driving at the max speed of the lane. Lanes without vehicles sleep until a vehicle enters them.
+    """
+
+    def __init__(self, lanes, step_length, config : SimStateAndConfig):
+        """
+        Args:
+            lanes (dict): Lanes of the simulation indexed by id
+            step_length (double): Duration of a simulation step in seconds
+            config (SimStateAndConfig): Configuration of the simulation
+        """
+        self.lanes = lanes
+        self.step_length = step_length
+        self.config = config
+        self.active = set(lanes.keys())
+        # Heap with the (step, lane id) in which the sleeping lanes have to be woken up
+        self.wake_ups = []
+        self.sleeping_until = dict()
+
+    def wake(self, lane_id):
+        """Makes a lane negotiate again from the current step, eg: because its leader changed"""
+        self.sleeping_until.pop(lane_id, None)
+        self.active.add(lane_id)
+
+    def wake_due(self, current_step):
+        """Wakes up the lanes whose leader could be reaching the negotiation zone in this step"""
+        while len(self.wake_ups) > 0 and self.wake_ups[0][0] <= current_step:
+            wake_step, lane_id = heapq.heappop(self.wake_ups)
+            # Ignore the entries of lanes that were woken up (and maybe put to sleep again) for other reasons
+            if self.sleeping_until.get(lane_id) == wake_step:
+                self.wake(lane_id)
+
+    def is_awake(self, lane_id):
+        return lane_id in self.active
+
+    def step_lane(self, lane, current_step):
+        """Lets the leader of an awake lane negotiate and puts the lane to sleep if it has nothing to do"""
+        leader = lane.step_leader()
+        if leader is None:
+            # Nothing to negotiate until a vehicle enters the lane
+            self.active.discard(lane.id)
+        elif self._can_sleep(leader):
+            self._sleep(lane, leader, current_step)
+
+    def _can_sleep(self, leader):
+        # Only leaders driving normally outside the negotiation zone have nothing to do in the next steps
+        return (leader.state == Vehicle_State.AUTO
+                and leader.distance_to_intersection >= self.config.start_negotiating_at_distance_from_intersection)
+
+    def _sleep(self, lane, leader, current_step):
+        distance_to_zone = leader.distance_to_intersection - self.config.start_negotiating_at_distance_from_intersection
+        max_speed = max(lane.max_speed, leader.speed)
+        steps = math.floor(distance_to_zone / (max_speed * self.step_length)) if max_speed > 0 else 1
+        if steps <= 1:
+            return
+        wake_step = current_step + steps
+        self.active.discard(lane.id)
+        self.sleeping_until[lane.id] = wake_step
+        heapq.heappush(self.wake_ups, (wake_step, lane.id))
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import glob
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from TripinfoReader import TripinfoReader
+
+# Files written by runner.run_batch: data/results/<date>/tripinfo__t_<traffic>_<traffic>__d_<deceivers>_<deceivers>.xml
+RESULT_FILE_PATTERN = re.compile(
+    r"(\d{4}-\d{2}-\d{2}[^\\/]*)[\\/]tripinfo__t_([^_]*)_([^_]*)__d_([^_]*)_([^_]*)\.xml$")
+
+
+def result_parameters(source):
+    """Parameters of the run of a result file, read from its path
+
+    Args:
+        source (str): Path of a tripinfo file of runner.run_batch
+
+    Returns:
+        dict: run_name, traffic_level_1, traffic_level_3, deceiving_level_1 and deceiving_level_3, None if the path
+            does not follow the naming of the results
+    """
+    match = RESULT_FILE_PATTERN.search(source)
+    if match is None:
+        return None
+    return dict(run_name=match.group(1), traffic_level_1=match.group(3), traffic_level_3=match.group(2),
+                deceiving_level_1=match.group(5), deceiving_level_3=match.group(4))
+
+
+def ingest_result(source, partition_file):
+    """Reads a tripinfo file and writes its columns to a partition of the store, it is the function run by the
+    worker processes
+
+    Args:
+        source (str): Path of the tripinfo file
+        partition_file (str): Path of the .npz file of the partition
+
+    Returns:
+        int: number of trips in the partition
+    """
+    trips = TripinfoReader.read(source)
+    os.makedirs(os.path.dirname(partition_file), exist_ok=True)
+    # Written aside and moved once complete so readers never find half a partition
+    temporary_file = f"{partition_file}.{os.getpid()}.tmp.npz"
+    np.savez(temporary_file, **trips)
+    os.replace(temporary_file, partition_file)
+    return len(trips["id"])
+
+
+class ResultStore:
+    """Local columnar store of the tripinfo files of the experiments.
+
+    Each result file is stored as a .npz partition named after the parameters of its run, and a manifest records the
+    size and modification time of the files ingested so ingesting a folder again only processes the files that are
+    new or changed. The files are parsed in a pool of processes.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory="data/store", processes=None):
+        """
+        Args:
+            directory (str, optional): Directory of the partitions and the manifest. Defaults to "data/store".
+            processes (int, optional): Number of worker processes, 1 parses the files in this process. Defaults to
+                the number of cores.
+        """
+        self.directory = directory
+        self.processes = processes if processes is not None else os.cpu_count()
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        manifest_file = os.path.join(self.directory, self.MANIFEST)
+        if not os.path.exists(manifest_file):
+            return dict()
+        with open(manifest_file) as manifest:
+            return json.load(manifest)
+
+    def _write_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        manifest_file = os.path.join(self.directory, self.MANIFEST)
+        with open(f"{manifest_file}.tmp", "w") as manifest:
+            json.dump(self.manifest, manifest, indent=1, sort_keys=True)
+        os.replace(f"{manifest_file}.tmp", manifest_file)
+
+    def partition_file(self, parameters):
+        """Path of the partition of the run with the given parameters, see result_parameters"""
+        return os.path.join(self.directory, parameters["run_name"],
+                            f"traffic_{parameters['traffic_level_1']}_{parameters['traffic_level_3']}",
+                            f"deceiving_{parameters['deceiving_level_1']}_{parameters['deceiving_level_3']}.npz")
+
+    def pending(self, sources):
+        """Result files that are not in the store or changed since they were ingested"""
+        pending = []
+        for source in sources:
+            stat = os.stat(source)
+            entry = self.manifest.get(os.path.abspath(source))
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                pending.append(source)
+        return pending
+
+    def ingest(self, sources, commit=True):
+        """Stores the result files that are new or changed
+
+        Args:
+            sources (list of str): Paths of the tripinfo files, the ones not following the naming of the results are
+                ignored
+            commit (bool, optional): Record the files in the manifest right away. False leaves it to the caller, who
+                calls commit once the files have been processed further, so they are ingested again if that fails.
+                Defaults to True.
+
+        Returns:
+            list of dict: the entries of the manifest of the files ingested, with the parameters of their run and
+                their partition
+        """
+        entries = []
+        for source in self.pending(sources):
+            parameters = result_parameters(source)
+            if parameters is None:
+                print("Ignoring file with unknown name: ", source)
+                continue
+            stat = os.stat(source)
+            entries.append(dict(parameters, source=os.path.abspath(source), size=stat.st_size,
+                                mtime_ns=stat.st_mtime_ns, partition=self.partition_file(parameters)))
+
+        if self.processes <= 1 or len(entries) <= 1:
+            trips = [ingest_result(entry["source"], entry["partition"]) for entry in entries]
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.processes, len(entries))) as pool:
+                trips = list(pool.map(ingest_result, [entry["source"] for entry in entries],
+                                      [entry["partition"] for entry in entries]))
+
+        for entry, number_trips in zip(entries, trips):
+            entry["trips"] = number_trips
+        if commit:
+            self.commit(entries)
+        return entries
+
+    def commit(self, entries):
+        """Records in the manifest the result files of the entries returned by ingest"""
+        for entry in entries:
+            self.manifest[entry["source"]] = entry
+        if len(entries) > 0:
+            self._write_manifest()
+
+    def ingest_folder(self, folder, commit=True):
+        """Stores the result files of a folder and its subfolders that are new or changed, see ingest"""
+        return self.ingest(sorted(glob.glob(os.path.join(folder, "**", "tripinfo__t_*.xml"), recursive=True)), commit)
+
+    @staticmethod
+    def read_partition(partition_file):
+        """Columns of a partition, see TripinfoReader.read"""
+        with np.load(partition_file) as partition:
+            return {name: partition[name] for name in partition.files}
+
+    def load(self):
+        """Columns of all the partitions in the store, along with the parameters of the run of each trip
+
+        Returns:
+            dict: numpy array indexed by column name with one value per trip
+        """
+        parameter_names = ["run_name", "traffic_level_1", "traffic_level_3", "deceiving_level_1", "deceiving_level_3"]
+        columns = dict()
+        for entry in sorted(self.manifest.values(), key=lambda entry: entry["partition"]):
+            partition = self.read_partition(entry["partition"])
+            number_trips = len(partition["id"])
+            for name in parameter_names:
+                partition[name] = np.full(number_trips, entry[name])
+            for name, values in partition.items():
+                columns.setdefault(name, []).append(values)
+        return {name: np.concatenate(values) for name, values in columns.items()}
@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from pathlib import Path
+from DemandGenerator import DemandGenerator
+
+
+class RouteCache:
+    """Route files stored under a hash of the parameters that generate them.
+
+    A route file is only generated the first time its parameters are requested, later requests (reruns of a point,
+    other processes of a sweep) reuse it. Files are generated with a temporary name and renamed once complete, so
+    processes generating the same file at the same time never read nor overwrite a half written one. Parameters
+    that can not be hashed, like a profile given as a function, bypass the cache.
+    """
+
+    def __init__(self, directory="data/routes"):
+        """
+        Args:
+            directory (str, optional): Directory of the cached route files. Defaults to "data/routes".
+        """
+        self.directory = directory
+
+    @staticmethod
+    def cacheable(**parameters):
+        """Whether the route file of the parameters can be cached, functions can not be hashed by what they return"""
+        return not any(callable(value) for value in parameters.values())
+
+    @staticmethod
+    def _json_value(value):
+        # Arrays (eg: a profile) are hashed by their type, shape and content
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            return dict(dtype=str(value.dtype), shape=list(value.shape),
+                        sha256=hashlib.sha256(value.tobytes()).hexdigest())
+        if isinstance(value, np.generic):
+            return value.item()
+        if callable(value):
+            raise TypeError(f"Route files generated with a function ({value!r}) can not be cached, see cacheable")
+        raise TypeError(f"Route parameter of type {type(value).__name__} can not be cached")
+
+    @staticmethod
+    def key(**parameters):
+        """Hash of the parameters of a route file along with the version of the generator
+
+        Args:
+            parameters: Parameters of runner.generate_routefile that determine the file, they must be json
+                serializable or numpy arrays
+
+        Returns:
+            str: hexadecimal hash of the parameters
+        """
+        # The numbers are compared by value, 2 and 2.0 generate the same file
+        normalized = {name: float(value) if isinstance(value, (int, float, np.number)) and not isinstance(value, bool)
+                      else value for name, value in parameters.items()}
+        normalized["generator_version"] = DemandGenerator.VERSION
+        content = json.dumps(normalized, sort_keys=True, default=RouteCache._json_value)
+        return hashlib.sha256(content.encode()).hexdigest()[:20]
+
+    def path(self, **parameters):
+        """Path of the route file of the parameters, see key"""
+        return os.path.join(self.directory, f"{self.key(**parameters)}.rou.xml")
+
+    def get(self, generate, **parameters):
+        """Path of the route file of the parameters, generating it if it is not in the cache yet
+
+        Args:
+            generate (callable): Function that writes the route file, receives the path in routefile and the parameters
+            parameters: Parameters of the route file, see key
+
+        Returns:
+            str: path of the route file. When the parameters are not cacheable it is a new file private to the caller
+                that is generated every time
+        """
+        if not self.cacheable(**parameters):
+            Path(self.directory).mkdir(parents=True, exist_ok=True)
+            descriptor, routefile = tempfile.mkstemp(prefix="uncached_", suffix=".rou.xml", dir=self.directory)
+            os.close(descriptor)
+            generate(routefile=routefile, **parameters)
+            return routefile
+        routefile = self.path(**parameters)
+        if os.path.exists(routefile):
+            return routefile
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        descriptor, temporary_file = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        os.close(descriptor)
+        try:
+            generate(routefile=temporary_file, **parameters)
+            os.replace(temporary_file, routefile)
+        except BaseException:
+            os.remove(temporary_file)
+            raise
+        return routefile
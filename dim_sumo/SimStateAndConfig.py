@@ -4,6 +4,12 @@ class SimStateAndConfig:
     def __init__(self):
         self.current_step = -1
         self.current_time_seconds = -1
+        # Per-step cache with the state of the vehicles, see VehicleStateCache
+        self.vehicle_states = None
+        # Per-step snapshot with the vehicles in each lane, see LaneOccupancy
+        self.lane_occupancy = None
+        # Vehicles of the simulation, one object per trip, see VehicleRegistry
+        self.vehicle_registry = None
         self.max_distance_between_adjacent_lanes = 20
         self.start_negotiating_at_distance_from_intersection = 50
         self.start_perception_at_distance_from_intersection = 30
@@ -21,6 +27,18 @@ class SimStateAndConfig:
         self.min_convoy_size = 8
         self.stopping_time_delay = 1
         self.min_braking_distance_to_intersection = 1
+        self.warm_up_steps = 1000 # Steps discarded at the beginning of a run when summarizing the city metrics
+        self.auto_warm_up = False # Choose the steps to discard in each run with MSER-5 instead, needs keep_city_series
+        self.keep_city_series = True # Keep the city metrics of every step (for plotting), the summaries do not need them
+        # Stop a run once the 95% confidence interval of the city flow and density is narrower than this fraction of
+        # their means (eg: 0.05), None runs until all the vehicles arrive. The runner then asks sumo to write the
+        # tripinfo of the unfinished vehicles too, otherwise the waiting times would only count the early arrivals
+        self.convergence_tolerance = None
+        self.convergence_batch_steps = 500 # Steps in each of the batches whose means are used for the interval
+        self.convergence_min_batches = 10
+        # Abort a run when no vehicle arrives in this many seconds and the leaders at the intersections are stuck, see
+        # GridlockDetector. None never aborts
+        self.gridlock_window_seconds = None
         self.log_info = False
         self.log_debug = False
         self.log_filter_regex = None #"right_(127|124|125)|down_(119)"
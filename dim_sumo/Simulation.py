@@ -1,61 +1,161 @@
 import Lane
-import traci
+import numpy as np
+from SumoBackend import traci
 from SimStateAndConfig import SimStateAndConfig
-from utils import mean_confidence_interval
+from VehicleStateCache import VehicleStateCache
+from LaneOccupancy import LaneOccupancy
+from VehicleRegistry import VehicleRegistry
+from LaneMetricStore import LaneMetricStore
+from LaneSpatialIndex import LaneSpatialIndex
+from NegotiationScheduler import NegotiationScheduler
+from GridlockDetector import GridlockDetector
+from utils import OnlineStatistics, BatchMeans, mean_confidence_interval, mser_truncation
 
 
 class Simulation:
 
     def __init__(self):
-        self.number_vehicles_in_lanes = dict()
-        self.avg_speed_vehicles_in_lanes = dict()
-        self.density_in_lanes = dict()
         self.lanes = dict()
-        self.flow_in_lanes = dict()
         self.config = SimStateAndConfig()
-        self.city_density = []
-        self.city_flow = []
-        self.city_vel = []
-        self.lanes_names = ["1to2" , "2to3" , "outr", "8to7" , "7to6" , "outl" , "9to2" , "2to6" , "outs" , "12to7", "7to3" , "outn"]
         # Initialize the lanes
         lane_ids = traci.lane.getIDList()
+        self.lane_lengths = dict()
         for lane_id in lane_ids:
             # Only consider lanes over 40 meters in length, this serves to remove lanes in intersections
             lane_length = traci.lane.getLength(lane_id)
+            self.lane_lengths[lane_id] = lane_length
             if lane_length > 40:
                 self.lanes[lane_id] = Lane.Lane(lane_id, lane_length, self.config)
-            self.number_vehicles_in_lanes[lane_id] = []
-            self.avg_speed_vehicles_in_lanes[lane_id] = []
-            self.density_in_lanes[lane_id] = []
-            self.flow_in_lanes[lane_id] = []
+        # The city metrics are measured in the lanes of the streets, leaving out the ones inside the intersections
+        self.measured_lanes = np.array([not lane.edge_id.startswith(":") for lane in self.lanes.values()])
         # The lanes are ready, let each of them figure out their adjacent lanes
         plain_lanes = self.lanes.values()
+        spatial_index = LaneSpatialIndex(plain_lanes, self.config.max_distance_between_adjacent_lanes)
+        for lane in plain_lanes:
+            lane.find_adjacent_lanes(spatial_index)
         for lane in plain_lanes:
-            lane.find_adjacent_lanes(plain_lanes)
+            lane.build_intersection_topology()
+        self.lane_order = {lane_id: i for i, lane_id in enumerate(self.lanes)}
+        self.reset()
+
+    def reset(self):
+        """Prepares the state for a new simulation in the same network, eg: after a traci.load. The lanes and their
+        topology are kept, everything that depends on the vehicles starts over.
+        """
+        self.config.current_step = -1
+        self.config.current_time_seconds = -1
+        for lane in self.lanes.values():
+            lane.reset()
+        # Subscriptions do not survive loading a simulation, subscribe again
+        self.vehicle_states = VehicleStateCache()
+        self.config.vehicle_states = self.vehicle_states
+        self.vehicle_registry = VehicleRegistry(self.config)
+        self.config.vehicle_registry = self.vehicle_registry
+        # Subscribe to the vehicles around the junctions to get the occupancy of all the lanes in each step
+        self.occupancy = LaneOccupancy(self.lane_lengths, self.config)
+        self.config.lane_occupancy = self.occupancy
+        self.city_density = []
+        self.city_flow = []
+        self.city_vel = []
+        # Running statistics of the city metrics after the warm up
+        self.city_density_stats = OnlineStatistics()
+        self.city_flow_stats = OnlineStatistics()
+        self.city_vel_stats = OnlineStatistics()
+        self.last_city_values = None
+        # Steps discarded at the beginning of the run when summarizing the city metrics, see city_summaries
+        self.warm_up_steps_used = self.config.warm_up_steps
+        # Batch means of the city metrics after the warm up to decide when they have converged
+        self.city_density_batches = BatchMeans(self.config.convergence_batch_steps)
+        self.city_flow_batches = BatchMeans(self.config.convergence_batch_steps)
+        self.converged_at_step = None
+        # Time series of the metrics of each of the lanes, one column per lane
+        self.lane_metrics = LaneMetricStore(self.lanes.keys(), ["number_vehicles", "density", "avg_speed", "flow"])
+        # Only the lanes with a leader close to the intersection negotiate in each step
+        self.scheduler = NegotiationScheduler(self.lanes, traci.simulation.getDeltaT(), self.config)
+        # Lanes that had vehicles at the end of the last step
+        self.populated_lanes = set()
+        self.gridlock_detector = GridlockDetector(self.lanes, traci.simulation.getDeltaT(), self.config)
+        # Description of the gridlock the simulation got stuck in, if any
+        self.gridlock = None
+
+    def subscribe(self):
+        """Subscribes again to the values received in each step, eg: after restoring a saved state"""
+        self.vehicle_states.subscribe()
+        self.occupancy.subscribe()
 
     def step(self, current_step, traffic_lights):
         self.config.current_step = current_step
         self.config.current_time_seconds = traci.simulation.getTime()
-        # Send all lanes the update
-        for lane_id in self.lanes:
-            self.lanes[lane_id].step(current_step, traffic_lights)
-            self.number_vehicles_in_lanes[lane_id].append(len(traci.lane.getLastStepVehicleIDs(lane_id)))
-            length_total_veh = 0
-            if self.number_vehicles_in_lanes[lane_id][-1] <= 0:
-                length_total_veh = 0
-            else:
-                length_total_veh = (self.number_vehicles_in_lanes[lane_id][-1] * 10 - 5)
-            self.density_in_lanes[lane_id].append(length_total_veh/500)
-            if len(traci.lane.getLastStepVehicleIDs(lane_id)) == 0:
-                val_speed = 0
-            else:
-                val_speed = mean_confidence_interval([traci.vehicle.getSpeed(veh) for veh in traci.lane.getLastStepVehicleIDs(lane_id)])[0]
-
-            self.avg_speed_vehicles_in_lanes[lane_id].append(val_speed)
-            self.flow_in_lanes[lane_id].append(self.density_in_lanes[lane_id][-1] * self.avg_speed_vehicles_in_lanes[lane_id][-1])
-
-
-        self.city_density.append(float(mean_confidence_interval([v[-1] for k, v in self.density_in_lanes.items() if k[:-2] in self.lanes_names])[0]))
-        self.city_flow.append(float(mean_confidence_interval([v[-1] for k, v in self.flow_in_lanes.items() if k[:-2] in self.lanes_names])[0]))
-        self.city_vel.append(float(mean_confidence_interval([v[-1] for k, v in self.avg_speed_vehicles_in_lanes.items() if k[:-2] in self.lanes_names])[0]))
+        self.vehicle_states.step()
+        self.vehicle_registry.step()
+        self.occupancy.step()
+        # Only the lanes that have or had vehicles need to be updated, and only the awake ones negotiate. They are
+        # processed in the usual order so each leader sees the lanes before it already updated
+        self.scheduler.wake_due(current_step)
+        updated_lanes = self.populated_lanes.union(lane_id for lane_id in self.occupancy.lane_vehicle_ids if lane_id in self.lanes)
+        self.populated_lanes = set()
+        for lane_id in sorted(updated_lanes.union(self.scheduler.active), key=self.lane_order.get):
+            lane = self.lanes[lane_id]
+            if lane_id in updated_lanes:
+                if lane.update_vehicles(current_step):
+                    self.scheduler.wake(lane_id)
+                if len(lane.vehicles) > 0:
+                    self.populated_lanes.add(lane_id)
+            # Give the leading vehicle a chance to comunicate with other vehicles
+            if not traffic_lights and self.scheduler.is_awake(lane_id):
+                self.scheduler.step_lane(lane, current_step)
+
+        # Measure the lanes
+        number_vehicles, speed_sums = self.occupancy.lane_totals(self.lane_metrics.lane_index)
+        occupied = number_vehicles > 0
+        density = np.where(occupied, number_vehicles * 10 - 5, 0) / self.config.lane_length
+        avg_speed = np.divide(speed_sums, number_vehicles, out=np.zeros(len(speed_sums)), where=occupied)
+        flow = density * avg_speed
+        self.lane_metrics.append(number_vehicles=number_vehicles, density=density, avg_speed=avg_speed, flow=flow)
+
+        city_values = (float(density[self.measured_lanes].mean()), float(flow[self.measured_lanes].mean()),
+                       float(avg_speed[self.measured_lanes].mean()))
+        if self.config.keep_city_series:
+            self.city_density.append(city_values[0])
+            self.city_flow.append(city_values[1])
+            self.city_vel.append(city_values[2])
+        self.update_city_statistics(current_step, city_values)
+        if self.gridlock is None:
+            self.gridlock = self.gridlock_detector.step(current_step)
+
+    def update_city_statistics(self, current_step, city_values):
+        # The last step of a run is left out of the statistics, so the values of each step are added when the
+        # next step arrives
+        if self.last_city_values is not None and current_step - 1 >= self.config.warm_up_steps:
+            self.city_density_stats.add(self.last_city_values[0])
+            self.city_flow_stats.add(self.last_city_values[1])
+            self.city_vel_stats.add(self.last_city_values[2])
+            self.city_density_batches.add(self.last_city_values[0])
+            self.city_flow_batches.add(self.last_city_values[1])
+        self.last_city_values = city_values
+
+    def city_summaries(self):
+        """Confidence intervals of the city density, flow and velocity leaving out the warm up and the last step. With
+        auto_warm_up the warm up of the run is found with MSER-5 on the city series, the longest of the three is used.
+
+        Returns:
+            ((float, float, float), (float, float, float), (float, float, float)): mean, lower and upper bounds of
+                the density, flow and velocity
+        """
+        if not self.config.auto_warm_up:
+            self.warm_up_steps_used = self.config.warm_up_steps
+            return (self.city_density_stats.confidence_interval(), self.city_flow_stats.confidence_interval(),
+                    self.city_vel_stats.confidence_interval())
+        if not self.config.keep_city_series:
+            raise ValueError("auto_warm_up needs the city series, enable keep_city_series")
+        series = (self.city_density[:-1], self.city_flow[:-1], self.city_vel[:-1])
+        self.warm_up_steps_used = max(mser_truncation(values) for values in series)
+        return tuple(mean_confidence_interval(values[self.warm_up_steps_used:]) for values in series)
 
+    def converged(self):
+        """Whether the city density and flow are settled enough to stop the run, see convergence_tolerance"""
+        tolerance = self.config.convergence_tolerance
+        min_batches = self.config.convergence_min_batches
+        return (tolerance is not None
+                and self.city_flow_batches.converged(tolerance, min_batches)
+                and self.city_density_batches.converged(tolerance, min_batches))
@@ -0,0 +1,70 @@
+from SumoBackend import traci
+from Simulation import Simulation
+
+
+class SimulationSession:
+    """Keeps one sumo process running to execute several simulations one after another.
+
+    Each simulation is loaded in the running process with traci.load instead of starting a new one, and the
+    Simulation of the previous run is reset instead of rebuilt when the network is the same, so the lanes and their
+    topology are computed only once per network.
+    """
+
+    def __init__(self, sumoBinary, label="default"):
+        """
+        Args:
+            sumoBinary (str): Binary of sumo used to start the process, ignored by libsumo
+            label (str, optional): Label of the TraCI connection of the session. Defaults to "default".
+        """
+        self.sumoBinary = sumoBinary
+        self.label = label
+        self.started = False
+        self.cfg_file = None
+        self.simulation = None
+
+    def load(self, cfg_file, options, snapshot=None, config_overrides=None):
+        """Loads a simulation, starting sumo if it is not running yet
+
+        Args:
+            cfg_file (str): sumocfg file of the simulation, it determines the network
+            options (list of str): Other command line options for sumo
+            snapshot (WarmUpSnapshot, optional): Snapshot to start the simulation from. Defaults to None.
+            config_overrides (dict, optional): Values of SimStateAndConfig to change in the simulation restored from
+                the snapshot. Defaults to None.
+
+        Returns:
+            Simulation: the state of the simulation ready for its first step (or the step of the snapshot)
+        """
+        if snapshot is not None:
+            options = list(options) + snapshot.load_options()
+        args = ["-c", cfg_file] + list(options)
+        if not self.started:
+            traci.start([self.sumoBinary] + args, label=self.label)
+            self.started = True
+        else:
+            traci.load(args)
+
+        # Only rebuild the lanes if the network changed
+        if snapshot is not None:
+            self.simulation = snapshot.restore(config_overrides)
+        elif self.simulation is None or cfg_file != self.cfg_file:
+            self.simulation = Simulation()
+        else:
+            self.simulation.reset()
+        self.cfg_file = cfg_file
+        return self.simulation
+
+    def finish(self):
+        """Ends the current simulation so sumo writes all its outputs (eg: the tripinfo file) while the process keeps
+        running. It loads the same network without vehicles, which is cheap compared to starting sumo again.
+        """
+        if self.started:
+            traci.load(["-c", self.cfg_file, "--route-files", "", "--end", "0"])
+            # The load is completed when the next command is processed
+            traci.simulation.getTime()
+
+    def close(self):
+        if self.started:
+            traci.close()
+            self.started = False
+            self.simulation = None
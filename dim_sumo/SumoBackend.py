@@ -0,0 +1,49 @@
+import os
+
+
+class SumoBackend:
+    """Gives access to the library used to control SUMO.
+
+    SUMO can be controlled with traci, that starts it as a subprocess and talks to it over a socket, or with
+    libsumo, that loads SUMO in this same process avoiding the latency of each call. Both libraries have the same
+    API, so the modules use the traci object of this module as if it was the library and the calls are forwarded
+    to the library selected at startup with use().
+    """
+
+    def __init__(self):
+        self._module = None
+
+    def use(self, libsumo=None):
+        """Selects the library to control SUMO. Must be called before starting the simulation
+
+        Args:
+            libsumo (bool, optional): Use libsumo if it is available, otherwise traci. If None libsumo is used when
+                the LIBSUMO_AS_TRACI environment variable is set (the same switch used by the SUMO tools).
+
+        Returns:
+            bool: True if libsumo was selected
+        """
+        if libsumo is None:
+            libsumo = "LIBSUMO_AS_TRACI" in os.environ
+        module = None
+        if libsumo:
+            try:
+                import libsumo as module
+            except ImportError:
+                print("libsumo is not available, falling back to traci")
+        if module is None:
+            import traci as module
+        self._module = module
+        return self.is_libsumo()
+
+    def is_libsumo(self):
+        return self._module is not None and self._module.__name__ == "libsumo"
+
+    def __getattr__(self, name):
+        # Select the library with the default configuration if nobody did it before the first use
+        if self._module is None:
+            self.use()
+        return getattr(self._module, name)
+
+
+traci = SumoBackend()
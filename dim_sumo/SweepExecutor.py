@@ -0,0 +1,119 @@
+import os
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Sessions of the process indexed by sumo binary, the points executed by the same worker reuse its sumo process
+_sessions = dict()
+
+
+def close_sessions():
+    """Closes the sumo processes kept by the sessions of this process"""
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+
+
+def run_sweep_point(point, label, work_dir, libsumo=None):
+    """Executes the simulation of one point of a sweep, it is the function run by the worker processes
+
+    Args:
+        point (dict): Arguments for runner.generate_traffic_and_execute_sumo, the output_path and seed are optional
+        label (str): Label of the point, used to name its files
+        work_dir (str): Directory for the tripinfo files of the point and the cache of route files
+        libsumo (bool, optional): Library used to control sumo, see SumoBackend.use. Defaults to None.
+
+    Returns:
+        dict: the point along with the density, flow, velocity and waiting times measured, the warm up discarded and
+            the description of the gridlock if the simulation got stuck (see GridlockDetector)
+    """
+    # Imported here because runner uses this module to execute its sweeps
+    import runner
+    from SumoBackend import traci
+    from SimulationSession import SimulationSession
+
+    traci.use(libsumo=libsumo)
+    arguments = dict(point)
+    arguments.setdefault("output_path", os.path.join(work_dir, f"{label}.tripinfo.xml"))
+    arguments.setdefault("seed", 12)
+    # The vehicles also take random decisions while negotiating
+    random.seed(arguments["seed"])
+    sumoBinary = arguments.pop("sumoBinary")
+    if sumoBinary not in _sessions:
+        _sessions[sumoBinary] = SimulationSession(sumoBinary, label=f"session_{os.getpid()}_{len(_sessions)}")
+    density, flow, velocity = runner.generate_traffic_and_execute_sumo(
+        sumoBinary, route_cache_dir=os.path.join(work_dir, "routes"), label=label, plot=False,
+        session=_sessions[sumoBinary], **arguments)
+    waiting_time, waiting_time_priority = runner.emergency_control(arguments["output_path"])
+    return dict(point, label=label, tripinfo=arguments["output_path"], density=density, flow=flow, velocity=velocity,
+                waiting_time=waiting_time, waiting_time_priority=waiting_time_priority,
+                warm_up_steps=_sessions[sumoBinary].simulation.warm_up_steps_used,
+                gridlock=_sessions[sumoBinary].simulation.gridlock)
+
+
+class SweepExecutor:
+    """Runs the points of a parameter sweep in a pool of processes, each one with its own sumo instance.
+
+    Every point gets a private tripinfo file and each process its own labelled TraCI connection, so the points do
+    not interfere with each other no matter how they are distributed among the processes. The route files are shared
+    through a RouteCache, the points with the same traffic reuse the same file. The points
+    executed by the same process reuse its sumo process through a SimulationSession.
+    """
+
+    def __init__(self, processes=None, work_dir="data/sweeps", libsumo=None):
+        """
+        Args:
+            processes (int, optional): Number of worker processes, 1 runs the points in this process. Defaults to
+                the number of cores.
+            work_dir (str, optional): Directory for the tripinfo files and the route cache. Defaults to "data/sweeps".
+            libsumo (bool, optional): Library used to control sumo, see SumoBackend.use. Defaults to None.
+        """
+        self.processes = processes if processes is not None else os.cpu_count()
+        self.work_dir = work_dir
+        self.libsumo = libsumo
+
+    def run(self, points, prefix="sweep"):
+        """Executes the simulation of all the points
+
+        Args:
+            points (list of dict): Arguments for runner.generate_traffic_and_execute_sumo of each point
+            prefix (str, optional): Prefix of the labels of the points. Defaults to "sweep".
+
+        Returns:
+            list of dict: the results of run_sweep_point in the same order of the points
+        """
+        return list(self.results(points, prefix))
+
+    def results(self, points, prefix="sweep"):
+        """Executes the simulation of all the points giving back each result as soon as it and the ones of the
+        points before it are done, so they can be saved while the rest of the points run
+
+        Args:
+            points (list of dict): Arguments for runner.generate_traffic_and_execute_sumo of each point
+            prefix (str, optional): Prefix of the labels of the points. Defaults to "sweep".
+
+        Yields:
+            dict: the results of run_sweep_point in the same order of the points
+        """
+        Path(self.work_dir).mkdir(parents=True, exist_ok=True)
+        labels = [f"{prefix}_{i}" for i in range(len(points))]
+        if self.processes <= 1 or len(points) <= 1:
+            try:
+                for point, label in zip(points, labels):
+                    yield run_sweep_point(point, label, self.work_dir, self.libsumo)
+            finally:
+                close_sessions()
+            return
+
+        # Spawn the workers so they don't inherit the state of libsumo or of an open connection
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=min(self.processes, len(points)), mp_context=context)
+        try:
+            futures = [pool.submit(run_sweep_point, point, label, self.work_dir, self.libsumo)
+                       for point, label in zip(points, labels)]
+            for future in futures:
+                yield future.result()
+        finally:
+            # A failed point or a caller that stops early does not wait for the points not started yet
+            pool.shutdown(cancel_futures=True)
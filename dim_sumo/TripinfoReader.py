@@ -0,0 +1,52 @@
+import array
+import numpy as np
+import xml.etree.ElementTree as ET
+
+
+class TripinfoReader:
+    """Reads the tripinfo output of sumo into numpy columns.
+
+    The file is parsed as a stream, each tripinfo element is dropped as soon as its attributes are read, so the
+    memory used does not grow with the size of the file besides the columns themselves. The roles of the vehicles
+    are taken from the suffixes of their ids, see DemandGenerator.
+    """
+
+    # Attributes read as numbers, in seconds
+    NUMERIC_ATTRIBUTES = ("depart", "arrival", "duration", "waitingTime")
+    # Attributes read as strings
+    TEXT_ATTRIBUTES = ("id", "departLane")
+    ROLE_SUFFIXES = dict(is_emergency="_emergency", is_flaw="_flaw", is_deceiver="_dec")
+
+    @staticmethod
+    def read(tripinfo_file):
+        """Reads the trips of a tripinfo file
+
+        Args:
+            tripinfo_file (str): Path of the tripinfo file
+
+        Returns:
+            dict: numpy array indexed by name with one value per trip: id and departLane (str), depart, arrival,
+                duration and waitingTime (float), and is_emergency, is_flaw and is_deceiver (bool)
+        """
+        numeric = {name: array.array("d") for name in TripinfoReader.NUMERIC_ATTRIBUTES}
+        text = {name: [] for name in TripinfoReader.TEXT_ATTRIBUTES}
+        root = None
+        for event, element in ET.iterparse(tripinfo_file, events=("start", "end")):
+            if root is None:
+                root = element
+            if event != "end" or element.tag != "tripinfo":
+                continue
+            attributes = element.attrib
+            for name, values in numeric.items():
+                values.append(float(attributes.get(name, "nan")))
+            for name, values in text.items():
+                values.append(attributes.get(name, ""))
+            # Drop the trips already read, the root would otherwise keep all of them
+            element.clear()
+            root.clear()
+
+        columns = {name: np.array(values, dtype=str) for name, values in text.items()}
+        columns.update({name: np.frombuffer(values, dtype=float) for name, values in numeric.items()})
+        for name, suffix in TripinfoReader.ROLE_SUFFIXES.items():
+            columns[name] = np.char.find(columns["id"], suffix) >= 0
+        return columns
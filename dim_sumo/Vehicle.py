@@ -1,6 +1,8 @@
+import math
 import random
 
-import traci
+from SumoBackend import traci
+import traci.constants as tc
 import numpy as np
 import Message
 import Lane
@@ -19,40 +21,55 @@ class Vehicle:
         self.id = id        
         self.config = config
         self.log = Log(config)
+        # The vehicle keeps its type during the whole trip, it is configured only once
+        self.max_decceleration = traci.vehicle.getDecel(self.id)
+        Vehicle.configure_driver(self.id)
+        self.enter_lane(lane)
+
+    def enter_lane(self, lane : Lane):
+        """Moves the vehicle to the lane it just entered, the negotiation of the intersection of the previous lane
+        is over so the vehicle starts over in AUTO
+        """
         self.current_step = -1
         self.lane = lane
         self.refresh_position()        
         self.state = Vehicle_State.AUTO
         self.distance_to_intersection = self.lane.lane_length
-        self.max_decceleration = traci.vehicle.getDecel(self.id)
         self.yielding_since_second = -1
         self.waiting_since_second = -1
         self.already_negotiation = False
         self.opposite_flaw_yielding_since_second = -1
-        # Set the speed mode of the vehicle to ignore intersection right of way
-        traci.vehicle.setSpeedMode(self.id, 23) # See: https://sumo.dlr.de/docs/TraCI/Change_Vehicle_State.html#speed_mode_0xb3
-        traci.vehicle.setTau(self.id, 0) # Setting the reaction time of the driver to 0 to simulate an autonomous agent       
         self.is_emergency = False
         self.is_flaw = False
         self.should_wait = False
         self.decision = None
+        # Opposite leader of the last negotiation, used to detect vehicles yielding to each other forever
+        self.negotiating_with = None
+
+    @staticmethod
+    def configure_driver(vehicle_id):
+        """Makes sumo drive the vehicle as an autonomous agent that negotiates the intersections"""
+        # Set the speed mode of the vehicle to ignore intersection right of way
+        traci.vehicle.setSpeedMode(vehicle_id, 23) # See: https://sumo.dlr.de/docs/TraCI/Change_Vehicle_State.html#speed_mode_0xb3
+        traci.vehicle.setTau(vehicle_id, 0) # Setting the reaction time of the driver to 0 to simulate an autonomous agent
 
 
     def refresh_position(self):
         if self.config.current_step > self.current_step:
-            try:
-                # We have not updated the position in this step, update now
-                self.position = np.array(traci.vehicle.getPosition(self.id))
-                self.lane_position = traci.vehicle.getLanePosition(self.id)
-                self.speed = traci.vehicle.getSpeed(self.id)
-                #traci.vehicle.setSpeed(self.id, 13)
-                #traci.vehicle.moveTo(self.id, self.lane.id, 450)
-
-                self.current_step = self.config.current_step
-                self.distance_to_intersection = self.lane.lane_length - self.lane_position
-                #self.distance_to_intersection = 50
-            except:
-                pass
+            # We have not updated the position in this step, read it from the states received for this step
+            state = self.config.vehicle_states.get(self.id)
+            if state is None:
+                # The vehicle is no longer in the simulation, keep the last known values
+                return
+            self.position = np.array(state[tc.VAR_POSITION])
+            self.lane_position = state[tc.VAR_LANEPOSITION]
+            self.speed = state[tc.VAR_SPEED]
+            #traci.vehicle.setSpeed(self.id, 13)
+            #traci.vehicle.moveTo(self.id, self.lane.id, 450)
+
+            self.current_step = self.config.current_step
+            self.distance_to_intersection = self.lane.lane_length - self.lane_position
+            #self.distance_to_intersection = 50
 
     def distance_to_vehicle(self, vehicle):
         return self.distance_to_point(vehicle.position)
@@ -66,7 +83,7 @@ class Vehicle:
         Returns:
             double: distance between the vehicle and the point
         """
-        return np.linalg.norm(self.position - point)
+        return math.hypot(self.position[0] - point[0], self.position[1] - point[1])
 
     def step_leader(self, lane) -> bool:
         # Update the vehicle lane and position
@@ -135,6 +152,7 @@ class Vehicle:
                 if (self.id == 'down3_171' and '20to27' in self.lane.id) or self.id == 'left2_3041' or self.id == 'left2_878':
                     print("Voy a fallar")
                 response = responses[0]
+                self.negotiating_with = response.sender
                 #self.log.debug(self, "opposite leader response", response)
                 #print("La respuesta recibida del lider opuesto es: ", response)
                 self.already_negotiation = True
@@ -166,6 +184,7 @@ class Vehicle:
 
                     #print("HUBO RESPUESTA EN PARCEPCION")
                     response = responses[0]
+                    self.negotiating_with = response.sender
                     if isFlaw:
                         #print("VOY a PROCESAR UNA FALLA PARANDO")
                         #If there is a leader and i'm a flaw i'll handle my yielding
@@ -254,7 +273,8 @@ class Vehicle:
 
                 if response.sender.lane.last_vehicle_convoy is not None:
                     try:
-                        last_vehicle_convoy_passed = response.sender.lane.last_vehicle_convoy.lane.id != traci.vehicle.getLaneID(response.sender.lane.last_vehicle_convoy.id)
+                        # The last vehicle of the convoy was in the lane of the sender when it was chosen
+                        last_vehicle_convoy_passed = response.sender.lane.id != traci.vehicle.getLaneID(response.sender.lane.last_vehicle_convoy.id)
                         if (self._timeout_expired() or convoy_completed) and last_vehicle_convoy_passed and not response.sender.is_emergency and str(type(response.sender)) == '<class \'Vehicle.Vehicle\'>':
                             self.log.info(self, " convoy completed")
                             self.state = Vehicle_State.GAINING_PRIORITY
@@ -585,6 +605,7 @@ class Vehicle:
     def __resume(self):
 
         self.waiting_since_second = -1
+        self.negotiating_with = None
         if self.__is_yielding():
             if (self.id == "left_24_flaw"):
                 print("SOY 22")
@@ -0,0 +1,57 @@
+from Vehicle import Vehicle
+from EmergencyVehicle import EmergencyVehicle
+from FlawVehicle import FlawVehicle
+from SimStateAndConfig import SimStateAndConfig
+
+
+class VehicleRegistry:
+    """Keeps one object per vehicle for its whole trip.
+
+    The object is created the first time the vehicle shows up in a lane, which for the vehicles inserted by the route
+    files is the step they depart, and it is moved from lane to lane until sumo reports the vehicle as arrived. The
+    parameters that do not change during the trip (deceleration, driver configuration) are set only once.
+    """
+
+    def __init__(self, config : SimStateAndConfig):
+        """
+        Args:
+            config (SimStateAndConfig): Configuration of the simulation, the arrivals are read from its vehicle_states
+        """
+        self.config = config
+        self.vehicles = dict()
+
+    @staticmethod
+    def vehicle_class(vehicle_id):
+        """Class of the vehicle according to the suffix of its id, see DemandGenerator"""
+        if "_flaw" in vehicle_id:
+            return FlawVehicle
+        if "_emergency" in vehicle_id:
+            return EmergencyVehicle
+        return Vehicle
+
+    def get(self, vehicle_id):
+        return self.vehicles.get(vehicle_id)
+
+    def enter_lane(self, vehicle_id, lane):
+        """Gets the vehicle that just entered a lane, creating it if it is new
+
+        Args:
+            vehicle_id (str): Id of the vehicle
+            lane (Lane): Lane the vehicle entered
+
+        Returns:
+            Vehicle: the vehicle, already moved to the lane
+        """
+        vehicle = self.vehicles.get(vehicle_id)
+        if vehicle is None:
+            vehicle = VehicleRegistry.vehicle_class(vehicle_id)(vehicle_id, lane, self.config)
+            self.vehicles[vehicle_id] = vehicle
+        else:
+            vehicle.lane.remove_vehicle(vehicle)
+            vehicle.enter_lane(lane)
+        return vehicle
+
+    def step(self):
+        """Drops the vehicles that arrived in the last simulation step, must be called after VehicleStateCache.step"""
+        for vehicle_id in self.config.vehicle_states.arrived_ids:
+            self.vehicles.pop(vehicle_id, None)
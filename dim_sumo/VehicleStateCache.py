@@ -0,0 +1,65 @@
+from SumoBackend import traci
+import traci.constants as tc
+
+
+class VehicleStateCache:
+    """Keeps the state of every vehicle in the simulation for the current step using TraCI subscriptions.
+
+    Vehicles are subscribed when they depart and SUMO drops their subscription when they arrive, so the state
+    of all of them is received in a single bulk response per step instead of one request per vehicle and variable.
+    """
+
+    VARIABLES = (tc.VAR_POSITION, tc.VAR_LANEPOSITION, tc.VAR_SPEED)
+
+    def __init__(self):
+        self.states = dict()
+        self.departed_ids = ()
+        self.arrived_ids = ()
+        self.subscribe()
+
+    def subscribe(self):
+        """Subscribes to the simulation and the vehicles in it, needed again after loading a simulation or a state"""
+        # Get the departed and arrived vehicles along with the results of each simulation step
+        traci.simulation.subscribe((tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS))
+        # Vehicles already in the network (if any) will not be reported as departed
+        for vehicle_id in traci.vehicle.getIDList():
+            traci.vehicle.subscribe(vehicle_id, self.VARIABLES)
+
+    def step(self):
+        """Subscribes the vehicles that departed in the last simulation step and refreshes the states of all of them.
+        Must be called once after each traci.simulationStep()
+        """
+        simulation_results = traci.simulation.getSubscriptionResults()
+        self.departed_ids = simulation_results[tc.VAR_DEPARTED_VEHICLES_IDS]
+        self.arrived_ids = simulation_results[tc.VAR_ARRIVED_VEHICLES_IDS]
+        for vehicle_id in self.departed_ids:
+            traci.vehicle.subscribe(vehicle_id, self.VARIABLES)
+        self.states = traci.vehicle.getAllSubscriptionResults()
+
+    def get(self, vehicle_id):
+        """Returns the subscribed values of a vehicle in the current step
+
+        Args:
+            vehicle_id (str): Id of the vehicle
+
+        Returns:
+            dict: Values of the vehicle indexed by TraCI variable or None if the vehicle is no longer in the simulation
+        """
+        state = self.states.get(vehicle_id)
+        if state is None:
+            try:
+                # The vehicle was not reported as departed (eg: it was inserted by other client), subscribe it now
+                traci.vehicle.subscribe(vehicle_id, self.VARIABLES)
+                state = traci.vehicle.getSubscriptionResults(vehicle_id)
+            except traci.TraCIException:
+                return None
+        return state
+
+    def position(self, vehicle_id):
+        return self.get(vehicle_id)[tc.VAR_POSITION]
+
+    def lane_position(self, vehicle_id):
+        return self.get(vehicle_id)[tc.VAR_LANEPOSITION]
+
+    def speed(self, vehicle_id):
+        return self.get(vehicle_id)[tc.VAR_SPEED]
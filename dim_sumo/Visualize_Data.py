@@ -7,11 +7,29 @@ import copy as cp
 import os
 from matplotlib.font_manager import FontProperties
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from data_digest import ensure_indexes
+from AggregateCube import AggregateCube
 from datetime import date
 
 
-## Plots heatmaps for a set of facts within a range of frequencies using all combinations of frequencies
-def plot_by_frequencies(result, facts=["queue_1", "queue_3"], titles=None, valid_frequencies = [0.25, 0.5, 0.75, 1], substract_base = 0):
+## Builds the table of a fact by the probabilities of deceivers of both lanes for a pair of frequencies. The fact is a
+## column of the results table or, when the aggregate cube is given, a statistic of AggregateCube.slice (eg: "mean",
+## "count" or "q0.5") of the measure of the trips selected by cube_filters (eg: role="deceiver")
+def fact_by_probabilities(result, fact, freq_1, freq_3, cube=None, measure="duration", cube_filters=None):
+    if cube is None:
+        data = result[(result["freq_1"] == freq_1) & (result["freq_3"] == freq_3)]
+        return pd.pivot_table(data, index="prob_1", columns="prob_3", values=fact)
+    quantiles = (float(fact[1:]),) if fact.startswith("q") else ()
+    aggregates = cube.slice(by=("prob_1", "prob_3"), measure=measure, quantiles=quantiles, freq_1=freq_1,
+                            freq_3=freq_3, **(cube_filters or dict()))
+    table = pd.DataFrame({ "prob_1" : aggregates["prob_1"], "prob_3" : aggregates["prob_3"], fact : aggregates[fact] })
+    return table.pivot(index="prob_1", columns="prob_3", values=fact).sort_index().sort_index(axis=1)
+
+## Plots heatmaps for a set of facts within a range of frequencies using all combinations of frequencies, see
+## fact_by_probabilities for the facts that can be read from the aggregate cube
+def plot_by_frequencies(result, facts=["queue_1", "queue_3"], titles=None, valid_frequencies = [0.25, 0.5, 0.75, 1], substract_base = 0,
+                        cube=None, measure="duration", cube_filters=None):
     
     num_facts = len(facts)
     titles = facts if titles is None else titles
@@ -20,19 +38,11 @@ def plot_by_frequencies(result, facts=["queue_1", "queue_3"], titles=None, valid
 
     for freq_1 in valid_frequencies:
         for freq_3 in valid_frequencies:
-            cond_1 = result["freq_1"] == freq_1
-            cond_2 = result["freq_3"] == freq_3
-            data = result[cond_1 & cond_2]            
-            X = data["prob_1"].unique()
-            Y = data["prob_3"].unique()
-            X.sort()
-            Y.sort()
-            
             fig, axes = plt.subplots(1, num_facts)
             fig.set_size_inches((12 * num_facts,12))
             
             for i, fact in enumerate(facts):           
-                Z = pd.pivot_table(data, index="prob_1", columns="prob_3", values=fact).round(2)
+                Z = fact_by_probabilities(result, fact, freq_1, freq_3, cube, measure, cube_filters).round(2)
                 ax = axes[i]
             
                 table = tbl.Table(ax, loc="best")
@@ -59,9 +69,10 @@ def plot_by_frequencies(result, facts=["queue_1", "queue_3"], titles=None, valid
             
     plt.show()
 
-## Plots lines for one probability of deceivers in a lane against all probabilities in the other
+## Plots lines for one probability of deceivers in a lane against all probabilities in the other, see
+## fact_by_probabilities for the facts that can be read from the aggregate cube
 def plot_tendency(result, facts=["queue_1", "queue_3"], titles=None, valid_frequencies = [0.25, 0.5, 0.75, 1], 
-                  substract_base = 0, formats=None, normalize=False):
+                  substract_base = 0, formats=None, normalize=False, cube=None, measure="duration", cube_filters=None):
     
     num_facts = len(facts)
     titles = facts if titles is None else titles
@@ -69,19 +80,12 @@ def plot_tendency(result, facts=["queue_1", "queue_3"], titles=None, valid_frequ
     
     for i, freq_1 in enumerate(valid_frequencies):
         for freq_3 in valid_frequencies[i:]:
-            cond_1 = result["freq_1"] == freq_1
-            cond_2 = result["freq_3"] == freq_3
-            data = result[cond_1 & cond_2]
-            X = data["prob_1"].unique()
-            Y = data["prob_3"].unique()
-            X.sort()
-            Y.sort()
-            
             fig, axes = plt.subplots(1, num_facts)
             fig.set_size_inches((15 * num_facts,15))
             
             for i, fact in enumerate(facts):           
-                Z = pd.pivot_table(data, index="prob_1", columns="prob_3", values=fact).round(2)
+                Z = fact_by_probabilities(result, fact, freq_1, freq_3, cube, measure, cube_filters).round(2)
+                Y = Z.columns.values
                 
                 Z = Z - substract_base
                 
@@ -105,30 +109,139 @@ def plot_tendency(result, facts=["queue_1", "queue_3"], titles=None, valid_frequ
             
     
     
-def plot_boxplot(sim_query_obj, veh_query_obj, variable, values, title="", num_experiments=None, substract_base = 0, db=MongoClient().tesis_DIM, show_outliers = True, tolerance = 0.001, debug = False, to_file=None, exp_suffix="", delay_range=[0,200]):
+# Returns the ids of the simulation runs for each value of the swept variable, at most num_experiments per value
+def run_ids_by_value(db, sim_query_obj, variable, values, num_experiments=None, tolerance=0.001, exp_suffix="", debug=False):
     sim_query_obj = cp.copy(sim_query_obj)
-    veh_query_obj = cp.copy(veh_query_obj)
-    values = cp.copy(values)
     sim_query_obj["done"] = True
-    
-    data = []
+    sim_query_obj[variable] = { "$gt" : min(values) - tolerance, "$lt" : max(values) + tolerance }
+    print(sim_query_obj) if debug else None
+    ids = { val : [] for val in values }
+    for sim in db["sim" + exp_suffix].find(sim_query_obj, { "_id":1, variable:1 }):
+        for val in values:
+            if abs(sim[variable] - val) < tolerance:
+                ids[val].append(sim["_id"])
+    ids = { val : run_ids[0:num_experiments] for val, run_ids in ids.items() }
+    print("Sim ids:", ids) if debug else None
+    return ids
+
+# Pipeline stages selecting the vehicles of the runs and tagging each one with the value of the variable of its run
+def vehicles_by_value_stages(ids_by_value, veh_query_obj):
+    all_ids = [run_id for run_ids in ids_by_value.values() for run_id in run_ids]
+    branches = [{ "case" : { "$in" : ["$run_id", run_ids] }, "then" : float(val) } for val, run_ids in ids_by_value.items() if len(run_ids) > 0]
+    return [
+        { "$match" : { "$and" : [ { "run_id" : { "$in" : all_ids } }, veh_query_obj ] } },
+        { "$project" : { "_id" : 0, "delay" : 1, "value" : { "$switch" : { "branches" : branches, "default" : None } } } }
+    ]
+
+# Quartiles of the delays as numpy computes them, interpolating between the delays at the ranks around each one
+QUARTILES = [0.25, 0.5, 0.75]
+
+def quartiles_from_ranks(delay_at, count):
+    quartiles = []
+    for quartile in QUARTILES:
+        position = quartile * (count - 1)
+        low, high = int(np.floor(position)), int(np.ceil(position))
+        quartiles.append(delay_at[low] + (position - low) * (delay_at[high] - delay_at[low]))
+    return quartiles
+
+# Computes the statistics of the delays of the vehicles for each value of the variable in the server, in a single
+# aggregation. MongoDB 7.0 has $percentile, from 5.0 the vehicles of each value are numbered by their delay and only
+# the ones at the ranks around the quartiles are sent back. Older servers (and mongomock) stream the delays once and
+# the statistics are computed here
+def delay_statistics_by_value(db, ids_by_value, veh_query_obj, exp_suffix=""):
+    if not any(len(run_ids) > 0 for run_ids in ids_by_value.values()):
+        return dict()
+    stages = vehicles_by_value_stages(ids_by_value, veh_query_obj)
+    collection = db["sim_vehicles" + exp_suffix]
+    group = { "_id" : "$value", "mean" : { "$avg" : "$delay" }, "min" : { "$min" : "$delay" },
+              "max" : { "$max" : "$delay" }, "count" : { "$sum" : 1 } }
+    try:
+        quartiles = { "$percentile" : { "input" : "$delay", "p" : QUARTILES, "method" : "approximate" } }
+        result = collection.aggregate(stages + [ { "$group" : dict(group, quartiles=quartiles) } ])
+        return { row["_id"] : row for row in result }
+    except (OperationFailure, NotImplementedError):
+        pass
+
+    try:
+        whole_partition = { "documents" : ["unbounded", "unbounded"] }
+        last = { "$subtract" : ["$count", 1] }
+        around_quartiles = [{ "$eq" : ["$position", { rounding : { "$multiply" : [quartile, last] } }] }
+                            for quartile in QUARTILES for rounding in ["$floor", "$ceil"]]
+        result = collection.aggregate(stages + [
+            { "$setWindowFields" : { "partitionBy" : "$value", "sortBy" : { "delay" : 1 }, "output" : {
+                "position" : { "$documentNumber" : {} },
+                "count" : { "$count" : {}, "window" : whole_partition },
+                "mean" : { "$avg" : "$delay", "window" : whole_partition },
+                "min" : { "$min" : "$delay", "window" : whole_partition },
+                "max" : { "$max" : "$delay", "window" : whole_partition } } } },
+            # Ranks start at 0 like the positions of numpy
+            { "$set" : { "position" : { "$subtract" : ["$position", 1] } } },
+            { "$match" : { "$expr" : { "$or" : around_quartiles } } },
+            { "$group" : { "_id" : "$value", "mean" : { "$first" : "$mean" }, "min" : { "$first" : "$min" },
+                           "max" : { "$first" : "$max" }, "count" : { "$first" : "$count" },
+                           "ranks" : { "$push" : { "position" : "$position", "delay" : "$delay" } } } } ],
+            allowDiskUse=True)
+        statistics = dict()
+        for row in result:
+            delay_at = { rank["position"] : rank["delay"] for rank in row.pop("ranks") }
+            row["quartiles"] = quartiles_from_ranks(delay_at, row["count"])
+            statistics[row["_id"]] = row
+        return statistics
+    except (OperationFailure, NotImplementedError):
+        pass
+
+    delays_by_value = dict()
+    for row in collection.aggregate(stages):
+        delays_by_value.setdefault(row["value"], []).append(row["delay"])
+    statistics = dict()
+    for val, delays in delays_by_value.items():
+        delays = np.array(delays, dtype=float)
+        statistics[val] = { "_id" : val, "mean" : delays.mean(), "min" : delays.min(), "max" : delays.max(),
+                            "count" : len(delays), "quartiles" : list(np.percentile(delays, [25, 50, 75])) }
+    return statistics
+
+# Finds the delays out of the whiskers of each value, usually a few vehicles
+def delay_outliers_by_value(db, ids_by_value, veh_query_obj, whiskers, exp_suffix=""):
+    out_of_whiskers = [{ "value" : val, "$or" : [ { "delay" : { "$lt" : low } }, { "delay" : { "$gt" : high } } ] }
+                       for val, (low, high) in whiskers.items()]
+    if len(out_of_whiskers) == 0 or not any(len(run_ids) > 0 for run_ids in ids_by_value.values()):
+        return dict()
+    stages = vehicles_by_value_stages(ids_by_value, veh_query_obj) + [ { "$match" : { "$or" : out_of_whiskers } },
+                                                                       { "$group" : { "_id" : "$value", "delays" : { "$push" : "$delay" } } } ]
+    return { row["_id"] : row["delays"] for row in db["sim_vehicles" + exp_suffix].aggregate(stages) }
 
+def plot_boxplot(sim_query_obj, veh_query_obj, variable, values, title="", num_experiments=None, substract_base = 0, db=MongoClient().tesis_DIM, show_outliers = True, tolerance = 0.001, debug = False, to_file=None, exp_suffix="", delay_range=[0,200]):
+    ensure_indexes(db, exp_suffix)
+    values = cp.copy(values)
+    # Get the ids of the simulation runs to consider and the statistics of their vehicles computed in the server
+    ids_by_value = run_ids_by_value(db, sim_query_obj, variable, values, num_experiments, tolerance, exp_suffix, debug)
+    print(veh_query_obj) if debug else None
+    statistics = delay_statistics_by_value(db, ids_by_value, veh_query_obj, exp_suffix)
+
+    # Build the boxes the same way matplotlib does from the data
+    data = []
+    whiskers = dict()
     for val in values:
-        # Get the ids of the simulation runs to consider            
-        sim_query_obj[variable] = { "$gt" : val - tolerance, "$lt" : val + tolerance }
-        print(sim_query_obj) if debug else None
-        ids = db["sim" + exp_suffix].find(sim_query_obj, { "_id":1 }).distinct("_id")[0:num_experiments]
-        print("Sim ids:", ids) if debug else None
-        veh_query_obj["run_id"] = { "$in" : ids }
-        print(veh_query_obj) if debug else None
-        # Get the details for the selected simulations     
-        delays = db["sim_vehicles" + exp_suffix].find(veh_query_obj, 
-                                     { "_id" : 0, "delay":1 })
-        delays = pd.DataFrame(list(delays))
-        
-        if "delay" not in delays:
-            delays["delay"] = 0
-        data.append(delays["delay"]-substract_base)
+        label = round(val, 2)
+        row = statistics.get(float(val))
+        if row is None:
+            data.append(dict(label=label, med=np.nan, q1=np.nan, q3=np.nan, whislo=np.nan, whishi=np.nan, mean=np.nan,
+                             cilo=np.nan, cihi=np.nan, fliers=np.array([])))
+            continue
+        q1, med, q3 = row["quartiles"]
+        iqr = q3 - q1
+        whiskers[float(val)] = (max(row["min"], q1 - 1.5 * iqr), min(row["max"], q3 + 1.5 * iqr))
+        notch = 1.57 * iqr / np.sqrt(row["count"])
+        data.append(dict(label=label, med=med, q1=q1, q3=q3, whislo=whiskers[float(val)][0],
+                         whishi=whiskers[float(val)][1], mean=row["mean"], cilo=med - notch, cihi=med + notch,
+                         fliers=np.array([])))
+    if show_outliers:
+        outliers = delay_outliers_by_value(db, ids_by_value, veh_query_obj, whiskers, exp_suffix)
+        for val, stats in zip(values, data):
+            stats["fliers"] = np.array(outliers.get(float(val), []))
+    for stats in data:
+        for key in ["med", "q1", "q3", "whislo", "whishi", "mean", "cilo", "cihi", "fliers"]:
+            stats[key] = stats[key] - substract_base
 
     fig, axes = plt.subplots()
     fig.set_size_inches((15, 15))
@@ -136,8 +249,7 @@ def plot_boxplot(sim_query_obj, veh_query_obj, variable, values, title="", num_e
     axes.set_xlabel("$Probability_A$", fontsize=30)
     axes.set_ylabel(title, fontsize=30)
     # axes.set_title(title + " - {Y:A:"+str(round(1/sim_query_obj["freq_1"],2))+"Hz:[0,100]%} - " + " {X:B:" + str(round(1/sim_query_obj["freq_3"],2))+"Hz:"+str(sim_query_obj["prob_3"]*100)+"%}", fontsize=20)
-    bp_dict = axes.boxplot(data, notch=True, labels=values.round(2), showfliers=show_outliers, showmeans=True)
-    
+    bp_dict = axes.bxp(data, shownotches=True, showfliers=show_outliers, showmeans=True)
     # Code taken from https://stackoverflow.com/questions/18861075/overlaying-the-numeric-value-of-median-variance-in-boxplots
     for line in bp_dict['medians']:
         # get position data for median line
@@ -172,25 +284,24 @@ def plot_boxplot(sim_query_obj, veh_query_obj, variable, values, title="", num_e
         plt.savefig(to_file)
         
 def plot_histogram(sim_query_obj, veh_query_obj, variable, value, title="", num_experiments=None, substract_base = 0, db=MongoClient().tesis_DIM, tolerance = 0.001, debug = False, to_file=None, exp_suffix="", delay_range=[0,200]):
-    sim_query_obj = cp.copy(sim_query_obj)
-    veh_query_obj = cp.copy(veh_query_obj)
-    sim_query_obj["done"] = True
-    
-    # Get the ids of the simulation runs to consider            
-    sim_query_obj[variable] = { "$gt" : value - tolerance, "$lt" : value + tolerance }
-    print(sim_query_obj) if debug else None
-    ids = db["sim" + exp_suffix].find(sim_query_obj, { "_id":1 }).distinct("_id")[0:num_experiments]
-    print(ids) if debug else None
-    veh_query_obj["run_id"] = { "$in" : ids }
+    ensure_indexes(db, exp_suffix)
+    # Get the ids of the simulation runs to consider
+    ids_by_value = run_ids_by_value(db, sim_query_obj, variable, [value], num_experiments, tolerance, exp_suffix, debug)
     print(veh_query_obj) if debug else None
-    # Get the details for the selected simulations     
-    delays = db["sim_vehicles" + exp_suffix].find(veh_query_obj, 
-                                 { "_id" : 0, "delay":1 })
-    delays = pd.DataFrame(list(delays))
-    
-    if "delay" not in delays:
-        delays["delay"] = 0
-    delays["delay"] = delays["delay"]-substract_base
+    # Count the vehicles in the bins of the plot in the server
+    bins = np.linspace(delay_range[0], delay_range[1], 21)
+    counts = dict()
+    # Without runs there are no vehicles to count, and the server rejects a $switch without branches
+    if any(len(run_ids) > 0 for run_ids in ids_by_value.values()):
+        stages = vehicles_by_value_stages(ids_by_value, veh_query_obj) + [
+            { "$bucket" : { "groupBy" : "$delay", "boundaries" : list(bins + substract_base), "default" : "other",
+                            "output" : { "count" : { "$sum" : 1 } } } } ]
+        counts = { row["_id"] : row["count"] for row in db["sim_vehicles" + exp_suffix].aggregate(stages) }
+    # The densities are proportions of all the vehicles selected, the ones out of the range of the plot (in "other")
+    # included, so runs with more long delays show lower bars
+    total = sum(counts.values())
+    weights = [counts.get(bucket, 0) / (total * (bins[1] - bins[0])) if total > 0 else 0
+               for bucket in list(bins + substract_base)[:-1]]
 
     fig, axes = plt.subplots()
     fig.set_size_inches((15, 15))
@@ -198,7 +309,8 @@ def plot_histogram(sim_query_obj, veh_query_obj, variable, value, title="", num_
     axes.set_xlabel(title, fontsize=30)
     axes.set_ylabel("Acumulated proportion of vehicles", fontsize=30)
     # axes.set_title(title + " - {Y:A:"+str(round(1/sim_query_obj["freq_1"],2))+"Hz:[0,100]%} - " + " {X:B:" + str(round(1/sim_query_obj["freq_3"],2))+"Hz:"+str(sim_query_obj["prob_3"]*100)+"%}", fontsize=20)
-    axes.hist(delays["delay"], bins=20, density=True)
+    if total > 0:
+        axes.hist(bins[:-1], bins=bins, weights=weights)
     # Set the range of the X axis
     axes.set_xlim(delay_range)
     
@@ -208,9 +320,38 @@ def plot_histogram(sim_query_obj, veh_query_obj, variable, value, title="", num_
         plt.savefig(to_file)        
 
 
-def plot_tendencies_delay_and_count(valid_freqs=[0.5, 1.0], valid_probs=[0.0, 0.5, 1.0]):    
-    # Load the results
-    result = pd.read_csv("results/wave 009 - Exponential 30 mins full/from_mongo_600s_to_1800s_by_start_line_and_freqs1.5-2.0.csv")
+# Loads the aggregate cube of a result store to plot from it, adding first the runs of the store missing from it
+def cube_from_store(store_folder="data/store"):
+    cube = AggregateCube(store_folder)
+    cube.refresh()
+    return cube
+
+# Builds the table of results of the sweeps from the aggregate cube, one row per combination of frequencies and
+# probabilities with the total time and count of everyone, deceivers and honest vehicles of each lane (1: W->E, 3: N->S)
+def result_from_cube(cube, measure="duration"):
+    rows = dict()
+    aggregates = cube.slice(by=("freq_1", "freq_3", "prob_1", "prob_3", "movement", "role"), measure=measure,
+                            movement=["W->E", "N->S"])
+    for i in range(len(aggregates["count"])):
+        key = tuple(aggregates[name][i] for name in ["freq_1", "freq_3", "prob_1", "prob_3"])
+        row = rows.setdefault(key, dict(zip(["freq_1", "freq_3", "prob_1", "prob_3"], key)))
+        lane = "1" if aggregates["movement"][i] == "W->E" else "3"
+        groups = ["everyone", "deceivers"] if aggregates["role"][i] == "deceiver" else ["everyone", "honest"]
+        for group in groups:
+            time = aggregates["mean"][i] * aggregates["count"][i]
+            row[f"{group}_time_{lane}"] = row.get(f"{group}_time_{lane}", 0) + time
+            row[f"{group}_count_{lane}"] = row.get(f"{group}_count_{lane}", 0) + aggregates["count"][i]
+    result = pd.DataFrame(list(rows.values()))
+    for column in [f"{group}_{fact}_{lane}" for group in ["everyone", "deceivers", "honest"] for fact in ["time", "count"] for lane in ["1", "3"]]:
+        if column not in result:
+            result[column] = 0
+    return result.fillna(0)
+
+def plot_tendencies_delay_and_count(valid_freqs=[0.5, 1.0], valid_probs=[0.0, 0.5, 1.0], result=None):    
+    # Load the results, the table from result_from_cube can be given instead of the exported CSV
+    if result is None:
+        result = pd.read_csv("results/wave 009 - Exponential 30 mins full/from_mongo_600s_to_1800s_by_start_line_and_freqs1.5-2.0.csv")
+    result = result.copy()
     
     # Add a columns for the the average times for all, deceivers and not_deceivers
     result["avg_time_all_1"] = result["everyone_time_1"] / result["everyone_count_1"]
@@ -221,7 +362,8 @@ def plot_tendencies_delay_and_count(valid_freqs=[0.5, 1.0], valid_probs=[0.0, 0.
     result["avg_time_deceivers"] = (result["deceivers_time_1"]+result["deceivers_time_3"]) / (result["deceivers_count_1"]+result["deceivers_count_3"])
     result["avg_time_honest"] = (result["honest_time_1"]+result["honest_time_3"]) / (result["honest_count_1"]+result["honest_count_3"])
     result["everyone_count" ] = result["everyone_count_1"] + result["everyone_count_3"]
-    result["queue_both"] = result["queue_1"]+result["queue_3"]
+    if "queue_1" in result:
+        result["queue_both"] = result["queue_1"]+result["queue_3"]
     
     result = result[result["prob_3"].isin(valid_probs)]
     
@@ -315,20 +457,21 @@ def plot_histogram_delays(freq_1, freq_3, prob_1, prob_3, deceiver_value = None,
         delay_range=delay_range
     )
 
-experiment_suffix = ""
-freq_1 = 700
-freq_3 = 400
-delay_range = [0, 800]
-warmup_time = 60 * 15 # In seconds
-today = date.today().isoformat()
-movements_all = ["N->S", "W->E"]
+if __name__ == "__main__":
+    experiment_suffix = ""
+    freq_1 = 700
+    freq_3 = 400
+    delay_range = [0, 800]
+    warmup_time = 60 * 15 # In seconds
+    today = date.today().isoformat()
+    movements_all = ["N->S", "W->E"]
 
-directory = "./data/digest/" + today + experiment_suffix + "_vph_" + str(freq_1) + "_" + str(freq_3)  + "/" 
-if not os.path.exists(directory):
-    os.makedirs(directory)
-plot_box_delays(freq_1=freq_1, freq_3=freq_3, prob_3=0.0, movements=movements_all, to_file_prefix=directory+"all", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
-# plot_box_delays(freq_1=freq_1, freq_3=freq_3, prob_3=0.2, movements=movements_all, deceiver_value=False, to_file_prefix=directory+"no", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
-plot_histogram_delays(freq_1=freq_1, freq_3=freq_3, prob_1=0.0, prob_3=0.0, movements=movements_all, to_file_prefix=directory+"all_0", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
-plot_histogram_delays(freq_1=freq_1, freq_3=freq_3, prob_1=0.4, prob_3=0.0, movements=movements_all, to_file_prefix=directory+"all_1", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
-#plot_histogram_delays(freq_1=freq_1, freq_3=freq_3, prob_1=0.0, prob_3=0.0, deceiver_value=False, movements=movements_all, to_file_prefix=directory+"no_0", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
-#plot_histogram_delays(freq_1=freq_1, freq_3=freq_3, prob_1=0.0, prob_3=0.2, deceiver_value=False, movements=movements_all, to_file_prefix=directory+"no_1", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
+    directory = "./data/digest/" + today + experiment_suffix + "_vph_" + str(freq_1) + "_" + str(freq_3)  + "/" 
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    plot_box_delays(freq_1=freq_1, freq_3=freq_3, prob_3=0.0, movements=movements_all, to_file_prefix=directory+"all", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
+    # plot_box_delays(freq_1=freq_1, freq_3=freq_3, prob_3=0.2, movements=movements_all, deceiver_value=False, to_file_prefix=directory+"no", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
+    plot_histogram_delays(freq_1=freq_1, freq_3=freq_3, prob_1=0.0, prob_3=0.0, movements=movements_all, to_file_prefix=directory+"all_0", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
+    plot_histogram_delays(freq_1=freq_1, freq_3=freq_3, prob_1=0.4, prob_3=0.0, movements=movements_all, to_file_prefix=directory+"all_1", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
+    #plot_histogram_delays(freq_1=freq_1, freq_3=freq_3, prob_1=0.0, prob_3=0.0, deceiver_value=False, movements=movements_all, to_file_prefix=directory+"no_0", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
+    #plot_histogram_delays(freq_1=freq_1, freq_3=freq_3, prob_1=0.0, prob_3=0.2, deceiver_value=False, movements=movements_all, to_file_prefix=directory+"no_1", warmup_time=warmup_time, exp_suffix=experiment_suffix, delay_range=delay_range)
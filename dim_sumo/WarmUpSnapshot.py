@@ -0,0 +1,84 @@
+import re
+import pickle
+import random
+from SumoBackend import traci
+from Simulation import Simulation
+from Vehicle import Vehicle
+
+
+class WarmUpSnapshot:
+    """State of a simulation at the end of its warm up, used to fork several measured runs from it.
+
+    The state of sumo is saved with traci.simulation.saveState and the Python state (the Simulation with its lanes,
+    vehicles and negotiations, and the random generator used by the vehicles) is pickled next to it, so a fork only
+    has to load both instead of simulating the warm up again.
+    """
+
+    # Options sumo needs in the simulation that saves the state so the forks follow exactly the same trajectories
+    SAVE_OPTIONS = ["--save-state.rng", "--save-state.precision", "10"]
+    # sumo refuses to load the types with tau 0 it creates for the autonomous vehicles (see Vehicle.configure_driver),
+    # they are saved with a valid tau and the vehicles are configured again once loaded
+    AUTONOMOUS_TYPE = re.compile(r'(<vType id="[^"]*@([^"]+)"[^>]* tau=")0(\.0*)?"')
+
+    def __init__(self, state_file, simulation_file, step, autonomous_vehicle_ids=()):
+        """
+        Args:
+            state_file (str): File with the state of sumo
+            simulation_file (str): File with the pickled Simulation
+            step (int): Next step to simulate after the snapshot
+            autonomous_vehicle_ids (list of str, optional): Vehicles to configure again after loading the state
+        """
+        self.state_file = state_file
+        self.simulation_file = simulation_file
+        self.step = step
+        self.autonomous_vehicle_ids = list(autonomous_vehicle_ids)
+
+    @staticmethod
+    def save(state : Simulation, step, prefix):
+        """Saves the current state of the simulation
+
+        Args:
+            state (Simulation): State of the simulation running in sumo
+            step (int): Next step to simulate
+            prefix (str): Prefix of the files of the snapshot
+
+        Returns:
+            WarmUpSnapshot: the snapshot saved
+        """
+        snapshot = WarmUpSnapshot(f"{prefix}.state.xml", f"{prefix}.simulation.pkl", step)
+        traci.simulation.saveState(snapshot.state_file)
+        with open(snapshot.state_file) as state_file:
+            saved_state = state_file.read()
+        snapshot.autonomous_vehicle_ids = [m.group(2) for m in WarmUpSnapshot.AUTONOMOUS_TYPE.finditer(saved_state)]
+        with open(snapshot.state_file, "w") as state_file:
+            state_file.write(WarmUpSnapshot.AUTONOMOUS_TYPE.sub(r'\g<1>1"', saved_state))
+        with open(snapshot.simulation_file, "wb") as simulation_file:
+            pickle.dump((state, random.getstate()), simulation_file)
+        return snapshot
+
+    def load_options(self):
+        """Command line options for sumo to start the simulation from the snapshot"""
+        return ["--load-state", self.state_file]
+
+    def restore(self, config_overrides=None) -> Simulation:
+        """Restores the Python state of the snapshot, sumo must have been loaded with load_options
+
+        Args:
+            config_overrides (dict, optional): Values of SimStateAndConfig to change in the restored simulation.
+                Defaults to None.
+
+        Returns:
+            Simulation: the state of the simulation ready for the step of the snapshot
+        """
+        with open(self.simulation_file, "rb") as simulation_file:
+            state, random_state = pickle.load(simulation_file)
+        random.setstate(random_state)
+        for vehicle_id in self.autonomous_vehicle_ids:
+            Vehicle.configure_driver(vehicle_id)
+        # Subscriptions do not survive loading the state
+        state.subscribe()
+        for name, value in (config_overrides or dict()).items():
+            if not hasattr(state.config, name):
+                raise AttributeError(f"SimStateAndConfig has no attribute {name}")
+            setattr(state.config, name, value)
+        return state
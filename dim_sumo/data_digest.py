@@ -3,12 +3,15 @@ import pandas as pd
 import numpy as np
 import re
 import glob
-import xml.etree.cElementTree as ET
+from TripinfoReader import TripinfoReader
+from ResultStore import ResultStore
+from AggregateCube import AggregateCube
 from pymongo import MongoClient
 from PIL import Image
 
-# Given the output from AIM, in a pandas dataframe, add a new run of the simulation to the mongo database
-def add_run_to_mongo(input):
+# Given the output from AIM, in a pandas dataframe, add a new run of the simulation to the mongo database. When the
+# source file of the run is given, the runs previously added from it are replaced
+def add_run_to_mongo(input, source=None):
     client = MongoClient()
     db = client.tesis_DIM
     # We read the paramenters of the simulation from the first row, will fail if empty
@@ -21,6 +24,10 @@ def add_run_to_mongo(input):
         "freq_3" : float(row.traffic_level_3),
         "done" : True
     }
+    ensure_indexes(db)
+    if source is not None:
+        sim["source"] = source
+        remove_runs_from_mongo(db, source)
     result = db.sim.insert_one(sim)
     # Add the run id as a column in the dataset
     input["run_id"] = result.inserted_id
@@ -29,26 +36,40 @@ def add_run_to_mongo(input):
     input = input.drop(columns=["deceiving_level_1", "deceiving_level_3", "traffic_level_1", "traffic_level_3", "run_name"])
     # Transform key columns to numeric columns
     input[["start_time", "delay", "end_time"]] = input[["start_time", "delay", "end_time"]].apply(pd.to_numeric)
-    # Finally save the entries
-    db.sim_vehicles.insert_many(input.to_dict(orient="records"))
+    # Finally save the entries, unordered so the server can insert the batches in parallel
+    db.sim_vehicles.insert_many(input.to_dict(orient="records"), ordered=False)
+
+# Removes the runs added from a source file along with their vehicles, so a file that changed is not counted twice
+def remove_runs_from_mongo(db, source):
+    run_ids = [sim["_id"] for sim in db.sim.find({ "source" : source }, { "_id" : 1 })]
+    if len(run_ids) > 0:
+        db.sim_vehicles.delete_many({ "run_id" : { "$in" : run_ids } })
+        db.sim.delete_many({ "_id" : { "$in" : run_ids } })
+
+# Creates the indexes used to select the runs and their vehicles when plotting, does nothing if
+# they already exist
+def ensure_indexes(db, exp_suffix=""):
+    db["sim" + exp_suffix].create_index([("freq_1", 1), ("freq_3", 1), ("prob_1", 1), ("prob_3", 1), ("done", 1)])
+    db["sim" + exp_suffix].create_index([("source", 1)])
+    db["sim_vehicles" + exp_suffix].create_index([("run_id", 1), ("movement", 1), ("start_time", 1)])
 
 # Calculates the average travel time after grouping
 def times_per_group(input, group_by):
     group = input.groupby(by=group_by)
     return group["travel_time"].agg([np.mean, np.size, np.min, np.max, np.std])
 
-# Reads a CSV file and returns adataframe. Also includes the isDeceiver column if it 
+# Reads a tripinfo file and returns adataframe. Also includes the isDeceiver column if it 
 # is not present in the original file
 def read_input(input_file):
-    # Read the DIM input (adapted from https://stackoverflow.com/a/28267291)    
-    input = ET.parse(input_file).getroot()
-    # Load the info for every vehicle in the file
-    return pd.DataFrame(list(iter_read_input_helper(input)))
+    # Stream the file reading only the attributes used later on
+    return trips_to_data_frame(TripinfoReader.read(input_file))
 
-# Generate a dictionary for each element in the file yielding as we generate each one
-def iter_read_input_helper(input):
-    for tripinfo in  input.iter("tripinfo"):
-        yield tripinfo.attrib.copy()
+# Builds a dataframe from the columns of the trips of a tripinfo file
+def trips_to_data_frame(trips):
+    columns = ["id", "depart", "arrival", "duration", "waitingTime", "departLane"]
+    data_frame = pd.DataFrame({column: trips[column] for column in columns})
+    data_frame["isDeceiver"] = trips["is_deceiver"]
+    return data_frame
 
 # Adds the traffic level and deceiving level to all rows in the data set
 def extend_with_params(data_frame, traffic_level_1, traffic_level_3, deceiving_level_1, deceiving_level_3, run_name):
@@ -126,9 +147,22 @@ def stich_images_side_by_side(input_file_names, result_file_name):
 
     new_im.save(result_file_name)
 
-# Digest the information, mostly a way to use the other commans on a single call
-def digest(source_folder):
-    send_all_to_mongo_with_pattern(source_folder + "tripinfo__t_*.xml")
+# Digest the information, mostly a way to use the other commans on a single call. The files are
+# parsed in parallel into the local store and only the ones new or changed since the last call
+# are added to the aggregate cube and sent to mongo. A file is recorded as digested once it is
+# in mongo, so the files that failed are sent again in the next call
+def digest(source_folder, store_folder="data/store"):
+    store = ResultStore(store_folder)
+    entries = store.ingest_folder(source_folder, commit=False)
+    cube = AggregateCube(store_folder)
+    cube.refresh()
+    cube.update(entries)
+    for entry in entries:
+        input = trips_to_data_frame(ResultStore.read_partition(entry["partition"]))
+        extend_with_params(input, entry["traffic_level_1"], entry["traffic_level_3"], entry["deceiving_level_1"],
+                           entry["deceiving_level_3"], entry["run_name"])
+        add_run_to_mongo(input, entry["source"])
+        store.commit([entry])
 
 # Stich some images from the results
 def stich(prefix):
@@ -136,7 +170,8 @@ def stich(prefix):
     files = [base + "_" + x + ".png" for x in ["A", "B", "ALL"]]
     stich_images_side_by_side(files, base + ".png")
 
-folder="data\\results\\2020-10-13\\"
-#stich(folder + "\\all")
-#stich(folder + "\\no")
-digest(source_folder=folder)
\ No newline at end of file
+if __name__ == "__main__":
+    folder="data\\results\\2020-10-13\\"
+    #stich(folder + "\\all")
+    #stich(folder + "\\no")
+    digest(source_folder=folder)
\ No newline at end of file
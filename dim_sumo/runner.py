@@ -24,14 +24,20 @@ from __future__ import print_function
 import os
 import sys
 import optparse
-from numpy import random
 import numpy as np
 from pathlib import Path
 import datetime
+import inspect
 from Simulation import Simulation
 import matplotlib.pyplot as plt
 from utils import mean_confidence_interval
-import xml.etree.ElementTree as ET
+from SweepExecutor import SweepExecutor
+from SimulationSession import SimulationSession
+from WarmUpSnapshot import WarmUpSnapshot
+from DemandGenerator import DemandGenerator
+from RouteCache import RouteCache
+from TripinfoReader import TripinfoReader
+from GridlockDetector import GridlockError
 import json
 
 # we need to import python modules from the $SUMO_HOME/tools directory
@@ -42,20 +48,14 @@ else:
     sys.exit("please declare environment variable 'SUMO_HOME'")
 
 from sumolib import checkBinary  # noqa
-import traci  # noqa
-
-def get_node_number(i, j, city_size):
-    if (i == 0 and j == 0) or (i == 0 and j == (city_size + 1)) or (i == (city_size + 1) and j == 0) or (
-            i == (city_size + 1) and j == (city_size + 1)):
-        return -1
-    if i == 0 or i == (city_size + 1):
-        node = city_size * (city_size + 2) + 2 * (j - 1) + 1 + (i != 0)
-    else:
-        node = (i - 1) * (city_size + 2) + 1 + j
-    return node
+from SumoBackend import traci  # noqa
+
+# Seconds in which the generated route files introduce vehicles
+DEMAND_SECONDS = 3600
 
-def generate_routefile(seconds = 3600, pWE = 0.1, pNS = 0.1, pSN=0.1, pEW=0.1, dWE = 0.1, dNS = 0.0, pEmergency = 0.01,
-                       pFlaw=0.01, routefile=None, city_size=2):
+def generate_routefile(seconds = DEMAND_SECONDS, pWE = 0.1, pNS = 0.1, pSN=0.1, pEW=0.1, dWE = 0.0, dNS = 0.0, pEmergency = 0.01,
+                       pFlaw=0.01, routefile=None, city_size=2, seed=12, arrivals="bernoulli", profile=None,
+                       output="vehicles"):
     """ Generates a route file with the level of traffic described by the parameters
 
     Args:
@@ -64,176 +64,31 @@ def generate_routefile(seconds = 3600, pWE = 0.1, pNS = 0.1, pSN=0.1, pEW=0.1, d
         pNS (float, optional): Number of expected vehicles per second in the N->S direction. Defaults to 0.1.
         dWE (float, optional): Percentage of deceivers expected in the W->E direction. Defaults to 0.0.
         dNS (float, optional): Percentage of deceivers expected in the N->S direction. Defaults to 0.0.
+        seed (int, optional): Seed of the random generator. Defaults to 12 to make tests reproducible.
+        arrivals (str, optional): Distribution of the arrivals of each route in a second, "bernoulli" or "poisson".
+            Defaults to "bernoulli".
+        profile (callable or array, optional): Factor of the rates in each second to vary the demand over time, see
+            DemandGenerator. Defaults to None.
+        output (str, optional): "vehicles" to list every vehicle or "flows" to write one flow per route and role and
+            let sumo draw the vehicles, seeded with its --seed option. The flows keep the expected demand but not the
+            limit of one vehicle per route and second, see DemandGenerator.flows. Defaults to "vehicles".
     """
-    random.seed(12)  # make tests reproducible
-    deceiver_suffix = "_dec"
-    emergency_suffix = "_emergency"
-    flaw_suffix = "_flaw"
-    car_following_model = "IDM" # Suggested options:  IDM, ACC
-    tau = 1 # Expected time between vehicles in seconds
-    sigma = 0 # Driver imperfection in the range [0,1] where 0=perfect
-    following_model = f""" carFollowModel="{car_following_model}" sigma="{sigma}" tau="{tau}" """
-    car_specs = """ accel="0.8" decel="4.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger" """
-    depart_speed = "desired"
-
-    with open(routefile, "w") as routes:
-        print(f"""<routes>
-      <vType id="Car" length="5.00" minGap="2.50" maxSpeed="16.67" guiShape="passenger" carFollowModel="IDM" accel="0.8" decel="4.5" tau="1.0"/>
-            """, file=routes)
-        for i in range(1, city_size+1, 2): #Right routes
-            id_route = str(int((i+1)/2))
-            route = "    <route id=\"right" + id_route + "\" "
-            edges = []
-            for j in range(city_size):
-                node_from = get_node_number(i, j, city_size)
-                node_to = get_node_number(i, j+1, city_size)
-                edges.append(str(node_from) + "to" + str(node_to))
-            edges.append("outr" + id_route)
-            route += " edges=\"" + " ".join(edges) + "\" />"
-            print(route, file=routes)
-
-        for i in range(2, city_size+1, 2): #Left routes
-            id_route = str(int((i)/2))
-            route = "    <route id=\"left" + id_route + "\" "
-            edges = []
-            for j in range(city_size, 0, -1):
-
-                node_from = get_node_number(i, j + 1, city_size)
-                node_to = get_node_number(i, j, city_size)
-                edges.append(str(node_from) + "to" + str(node_to))
-            edges.append("outl" + id_route)
-            route += " edges=\"" + " ".join(edges) + "\" />"
-            print(route, file=routes)
-
-
-        for j in range(1, city_size+1, 2): #Down routes
-            id_route = str(int((j+1)/2))
-            route = "    <route id=\"down" + id_route + "\" "
-            edges = []
-            for i in range(city_size):
-                node_from = get_node_number(i, j, city_size)
-                node_to = get_node_number(i + 1, j, city_size)
-
-                edges.append(str(node_from) + "to" + str(node_to))
-            edges.append("outs" + id_route)
-            route += " edges=\"" + " ".join(edges) + "\" />"
-            print(route, file=routes)
-
-        for j in range(2, city_size+1, 2): #Up routes
-            id_route = str(int((j)/2))
-            route = "    <route id=\"up" + id_route + "\" "
-            edges = []
-            for i in range(city_size, 0, -1):
-
-                node_from = get_node_number(i + 1, j, city_size)
-                node_to = get_node_number(i, j, city_size)
-                edges.append(str(node_from) + "to" + str(node_to))
-            edges.append("outn" + id_route)
-            route += " edges=\"" + " ".join(edges) + "\" />"
-            print(route, file=routes)
-
-        """
-        
-        veh_der = 0
-        veh_izq = 0
-        veh_aba = 0
-        veh_arr = 0
-        veh_emergency = 0
-        veh_flaw = 0
-        dict_routes = {
-            "right": veh_der,
-            "left": veh_izq,
-            "up": veh_arr,
-            "down": veh_aba
-        }Nr
-        routes_list = ["right", "left", "up", "down"]
-        """
-        vehNr = 0
-        veh_emergency = 0
-        veh_flaw = 0
-        routes_list = []
-
-        mid_size = int((city_size+1)/2)
-        for i in range(mid_size):
-            routes_list.append("right" + str(i+1))
-            routes_list.append("down" + str(i + 1))
-        for i in range(city_size - mid_size):
-            routes_list.append("left" + str(i+1))
-            routes_list.append("up" + str(i + 1))
-
-        dict_routes = {}
-        for r in routes_list:
-            dict_routes[r] = 0
-
-
-        for i in range(seconds):
-
-            if random.uniform(0, 1) < pEmergency:
-                emergency = emergency_suffix
-                color = "red"
-                decision_route = routes_list[random.randint(0, len(routes_list))]
-                print(f'    <vehicle id="{decision_route}_%i{emergency}" type="Car" color="{color}" route="{decision_route}" departSpeed="{depart_speed}" depart="%i" />' % (vehNr, i), file=routes)
-                vehNr += 1
-                veh_emergency += 1
-                dict_routes[decision_route] += 1
-
-
-            elif random.uniform(0, 1) < pFlaw:
-                flaw = flaw_suffix
-                color = "blue"
-                decision_route = routes_list[random.randint(0, len(routes_list))]
-                print(f'    <vehicle id="{decision_route}_%i{flaw}" type="Car" color="{color}" route="{decision_route}" departSpeed="{depart_speed}" depart="%i" />' % (vehNr, i), file=routes)
-                vehNr += 1
-                veh_flaw += 1
-                dict_routes[decision_route] += 1
-
-            for j in range(mid_size):
-                if random.rand()< pWE:
-                    color = "yellow"
-                    decision_route = "right" + str(j+1)
-                    print(f'    <vehicle id="{decision_route}_%i" type="Car" color="{color}" route="{decision_route}" departSpeed="{depart_speed}" depart="%i" />' % (vehNr, i), file=routes)
-                    vehNr += 1
-                    dict_routes[decision_route] += 1
-
-            for j in range(mid_size):
-                if random.rand() < pNS:
-                    color = "yellow"
-                    decision_route = "down" + str(j + 1)
-                    print(f'    <vehicle id="{decision_route}_%i" type="Car" color="{color}" route="{decision_route}" departSpeed="{depart_speed}" depart="%i" />' % (
-                        vehNr, i), file=routes)
-                    vehNr += 1
-                    dict_routes[decision_route] += 1
-
-            for j in range(city_size - mid_size):
-                if random.rand() < pSN:
-                    color = "yellow"
-                    decision_route = "up" + str(j + 1)
-                    print(f'    <vehicle id="{decision_route}_%i" type="Car" color="{color}" route="{decision_route}" departSpeed="{depart_speed}" depart="%i" />' % (
-                        vehNr, i), file=routes)
-                    vehNr += 1
-                    dict_routes[decision_route] += 1
-
-            for j in range(city_size - mid_size):
-                if random.rand() < pEW:
-                    color = "yellow"
-                    decision_route = "left" + str(j + 1)
-                    print(f'    <vehicle id="{decision_route}_%i" type="Car" color="{color}" route="{decision_route}" departSpeed="{depart_speed}" depart="%i" />' % (
-                        vehNr, i), file=routes)
-                    vehNr += 1
-                    dict_routes[decision_route] += 1
-
-        for r in routes_list:
-            print(" Vehiculos por la ruta: ", r, dict_routes[r])
-
-        #print(" Vehiculos por la izquierda ", veh_izq)
-
-        #print(" Vehiculos por la derecha ", veh_der)
-        #print(" Vehiculos por la arriba ", veh_arr)
-        #print(" Vehiculos por la abajo ", veh_aba)
-        print(" Vehiculos totales ", vehNr)
-        print(" Vehiculos emergencia ", veh_emergency)
-        print(" Vehiculos con falla ", veh_flaw)
-        print("</routes>", file=routes)
+    generator = DemandGenerator(city_size=city_size, seconds=seconds, arrivals=arrivals, profile=profile, seed=seed)
+    demand = dict(pWE=pWE, pNS=pNS, pSN=pSN, pEW=pEW, dWE=dWE, dNS=dNS, pEmergency=pEmergency, pFlaw=pFlaw)
+    if output == "flows":
+        counts = generator.write_flows(routefile, **demand)
+        print(" Flujos ", counts["flows"])
+        print(" Vehiculos esperados ", counts["expected"])
+        return
+    if output != "vehicles":
+        raise ValueError(f"Unknown route output {output}, use vehicles or flows")
+    counts = generator.write(routefile, **demand)
+    for r in generator.special_routes():
+        print(" Vehiculos por la ruta: ", r, counts[r])
+    print(" Vehiculos totales ", counts["total"])
+    print(" Vehiculos emergencia ", counts["emergency"])
+    print(" Vehiculos con falla ", counts["flaw"])
+    print(" Vehiculos mentirosos ", counts["deceivers"])
 
 # The program looks like this
 #    <tlLogic id="0" type="static" programID="0" offset="0">
@@ -245,54 +100,122 @@ def generate_routefile(seconds = 3600, pWE = 0.1, pNS = 0.1, pSN=0.1, pEW=0.1, d
 #    </tlLogic>
 
 
-def run(traffic_lights=False, trafficlights_flaws=0.25, city_size=2, density=1):
-    """execute the TraCI control loop"""
-    state = Simulation()
-    total_trafficlights = list(traci.trafficlight.getIDList())
-    print(total_trafficlights)
-    #import random as rn
-    #flaw_trafficlights = rn.choice(total_trafficlights, max(int(len(total_trafficlights)*trafficlights_flaws), 1))
+def simulate(state, traffic_lights, step=0, stop_step=None):
+    """advance the simulation until there are no vehicles left
 
-    #for id in flaw_trafficlights:
-    #    new_phase = rn.choice([0, 2])
-    #    print("al semaforo", id, " lo vamos poner en fase ", new_phase)
-    #    traci.trafficlight.setPhase(id, new_phase)
-    step = 0
-    while traci.simulation.getMinExpectedNumber() > 0:
+    Args:
+        state (Simulation): State of the simulation
+        traffic_lights (bool): Whether the intersections are controlled by traffic lights
+        step (int, optional): Step to start from. Defaults to 0.
+        stop_step (int, optional): Step to stop at without simulating it, eg: the end of the warm up. Defaults to None.
+
+    Returns:
+        int: the next step to simulate
+    """
+    while traci.simulation.getMinExpectedNumber() > 0 and step != stop_step:
         traci.simulationStep()
         state.step(step, traffic_lights)
         if step == 20000:
             print("OMG SUPERASTE LOS 20000")
             break
         step += 1
-    print("*********************************************", step)
-    step_hot = 1000
-    step_stop = 1
+        if state.gridlock is not None:
+            print("Gridlock detected, aborting the run:", state.gridlock)
+            break
+        if state.converged():
+            # The city metrics are settled, simulating the rest of the run would not change them
+            state.converged_at_step = step
+            break
+    return step
+
+
+def report_convergence(state, step, demand_seconds=DEMAND_SECONDS):
+    """print the steps saved by stopping a run once it converged, see SimStateAndConfig.convergence_tolerance"""
+    if state.converged_at_step is None:
+        return
+    # The run would have lasted at least until the last vehicle was introduced
+    steps_saved = max(0, int((demand_seconds - traci.simulation.getTime()) / traci.simulation.getDeltaT()))
+    print("Converged at step", step, "with", traci.simulation.getMinExpectedNumber(), "vehicles left, at least",
+          steps_saved, "steps saved")
 
-    density_calc = mean_confidence_interval(state.city_density[step_hot:-step_stop])
-    flow = mean_confidence_interval(state.city_flow[step_hot:-step_stop])
-    vel = mean_confidence_interval(state.city_vel[step_hot:-step_stop])
 
+def summarize(state, city_size=2, density=1, plot=True):
+    """summarize the city metrics of a finished simulation, plotting them if requested"""
+    density_calc, flow, vel = state.city_summaries()
+    step_hot = state.warm_up_steps_used
+    step_stop = 1
 
-    plt.plot(range(len(state.city_density[step_hot:-step_stop])), state.city_density[step_hot:-step_stop])
+    print("Warm up steps discarded: ", step_hot)
     print("Average density City: ", density_calc)
-    plt.title("density")
-    plt.show()
-    plt.savefig(f'data/plots/{city_size}/density_{city_size}x{city_size}_{density}.png')
-    plt.clf()
-    plt.plot(range(len(state.city_flow[step_hot:-step_stop])), state.city_flow[step_hot:-step_stop])
     print("Average flow City: ", flow)
-    plt.title("flow")
-    plt.show()
-    plt.savefig(f'data/plots/{city_size}/flow_{city_size}x{city_size}_{density}.png')
-    plt.clf()
-    plt.plot(range(len(state.city_vel[step_hot:-step_stop])), state.city_vel[step_hot:-step_stop])
     print("Average velocity City: ", vel)
-    plt.title("vel")
-    plt.show()
-    plt.savefig(f'data/plots/{city_size}/vel_plot_{city_size}x{city_size}_{density}.png')
-    plt.clf()
-    traci.close()
+
+    if state.config.keep_city_series and plot:
+        plt.plot(range(len(state.city_density[step_hot:-step_stop])), state.city_density[step_hot:-step_stop])
+        plt.title("density")
+        plt.show()
+        plt.savefig(f'data/plots/{city_size}/density_{city_size}x{city_size}_{density}.png')
+        plt.clf()
+        plt.plot(range(len(state.city_flow[step_hot:-step_stop])), state.city_flow[step_hot:-step_stop])
+        plt.title("flow")
+        plt.show()
+        plt.savefig(f'data/plots/{city_size}/flow_{city_size}x{city_size}_{density}.png')
+        plt.clf()
+        plt.plot(range(len(state.city_vel[step_hot:-step_stop])), state.city_vel[step_hot:-step_stop])
+        plt.title("vel")
+        plt.show()
+        plt.savefig(f'data/plots/{city_size}/vel_plot_{city_size}x{city_size}_{density}.png')
+        plt.clf()
+    return density_calc, flow, vel
+
+
+def run(traffic_lights=False, trafficlights_flaws=0.25, city_size=2, density=1, keep_city_series=True, plot=True,
+        state=None, convergence_tolerance=None, auto_warm_up=False, gridlock_window_seconds=None,
+        demand_seconds=DEMAND_SECONDS):
+    """execute the TraCI control loop
+
+    Args:
+        state (Simulation, optional): State of an already loaded simulation, see SimulationSession. By default it is
+            created for the simulation just started and the connection is closed at the end.
+        convergence_tolerance (float, optional): Stop the run once the city metrics converge, see
+            SimStateAndConfig.convergence_tolerance. Defaults to None.
+        auto_warm_up (bool, optional): Choose the warm up to discard with MSER-5, see SimStateAndConfig.auto_warm_up.
+            Defaults to False.
+        gridlock_window_seconds (float, optional): Abort the run if it gets stuck, see
+            SimStateAndConfig.gridlock_window_seconds. Defaults to None.
+        demand_seconds (int, optional): Seconds in which the route file introduces vehicles, used to report the
+            steps saved by stopping at convergence. Defaults to DEMAND_SECONDS.
+
+    Raises:
+        GridlockError: if the run got stuck and no state was given, with a state the gridlock is left in
+            state.gridlock for the caller to check
+    """
+    close = state is None
+    if state is None:
+        state = Simulation()
+    state.config.keep_city_series = keep_city_series
+    state.config.convergence_tolerance = convergence_tolerance
+    state.config.auto_warm_up = auto_warm_up
+    state.config.gridlock_window_seconds = gridlock_window_seconds
+    total_trafficlights = list(traci.trafficlight.getIDList())
+    print(total_trafficlights)
+    #import random as rn
+    #flaw_trafficlights = rn.choice(total_trafficlights, max(int(len(total_trafficlights)*trafficlights_flaws), 1))
+
+    #for id in flaw_trafficlights:
+    #    new_phase = rn.choice([0, 2])
+    #    print("al semaforo", id, " lo vamos poner en fase ", new_phase)
+    #    traci.trafficlight.setPhase(id, new_phase)
+    step = simulate(state, traffic_lights)
+    print("*********************************************", step)
+    if close and state.gridlock is not None:
+        # The metrics of a stuck run are not a valid data point
+        traci.close()
+        raise GridlockError(state.gridlock)
+    report_convergence(state, step, demand_seconds)
+    density_calc, flow, vel = summarize(state, city_size=city_size, density=density, plot=plot)
+    if close:
+        traci.close()
     sys.stdout.flush()
     return density_calc, flow, vel
 
@@ -324,20 +247,83 @@ def get_options():
     optParser = optparse.OptionParser()
     optParser.add_option("--nogui", action="store_true",
                          default=False, help="run the commandline version of sumo")
+    optParser.add_option("--libsumo", action="store_true",
+                         default=None, help="run sumo in this process with libsumo instead of traci (no gui)")
     options, args = optParser.parse_args()
     return options
 
-def generate_traffic_and_execute_sumo(sumoBinary, output_path, pWE = 0.1, pNS = 0.1, dWE = 0.1, pEW=0.1, pSN=0.1,
-                                      dNS = 0.0, pEmergency=0.01, pFlaw=0.01, traffic_lights=False, trafficlights_flaws=0.25, city_size=2):
+def cached_routefile(route_cache_dir="data/routes", **traffic):
+    """ Route file of the traffic taken from the cache, it is only generated if it is not there yet
+
+    Args:
+        route_cache_dir (str, optional): Directory of the cached route files. Defaults to "data/routes".
+        traffic: Parameters of generate_routefile, the ones missing take their default value
+
+    Returns:
+        str: path of the route file
+    """
+    arguments = inspect.signature(generate_routefile).bind(**traffic)
+    arguments.apply_defaults()
+    parameters = dict(arguments.arguments)
+    parameters.pop("routefile")
+    return RouteCache(route_cache_dir).get(generate_routefile, **parameters)
+
+def sumo_cfg_file(city_size, traffic_lights):
+    return f"data/ciudad{city_size}x{city_size}_semaforo.sumocfg" if traffic_lights else f"data/cross{city_size}x{city_size}.sumocfg"
 
-    name_according_city = str(city_size) + "x" + str(city_size)
-    routefile= "data/ciudad" + name_according_city + "_semaforo.rou.xml" if traffic_lights else "data/cross"+ name_according_city + ".rou.xml"
-    # first, generate the route file for this simulation
 
+def generate_traffic_and_execute_sumo(sumoBinary, output_path, pWE = 0.1, pNS = 0.1, dWE = 0.0, pEW=0.1, pSN=0.1,
+                                      dNS = 0.0, pEmergency=0.01, pFlaw=0.01, traffic_lights=False, trafficlights_flaws=0.25, city_size=2,
+                                      routefile=None, seed=12, label="default", plot=True, session=None,
+                                      convergence_tolerance=None, auto_warm_up=False, gridlock_window_seconds=None,
+                                      route_output="vehicles", route_cache_dir="data/routes", seconds=DEMAND_SECONDS,
+                                      arrivals="bernoulli", profile=None):
+    """ Generates the traffic for a simulation and executes it
+
+    Args:
+        routefile (str, optional): Route file to generate, by default the route file of the traffic is taken from the
+            cache and only generated if it is not there. Runs executed at the same time must use different files.
+        seed (int, optional): Seed for the generation of the traffic. Defaults to 12.
+        label (str, optional): Label of the TraCI connection, must be unique among the simulations running at the
+            same time from one process. Defaults to "default".
+        plot (bool, optional): Whether to save the plots of the city metrics. Defaults to True.
+        session (SimulationSession, optional): Session to load the simulation in instead of starting sumo, the
+            binary and label are the ones of the session. Defaults to None.
+        convergence_tolerance (float, optional): Stop the simulation once the city metrics converge, see
+            SimStateAndConfig.convergence_tolerance. The tripinfo file then also lists the vehicles that had not
+            arrived yet, with an arrival of -1 and their duration and waiting time up to the stop. Defaults to None.
+        auto_warm_up (bool, optional): Choose the warm up to discard with MSER-5, the steps discarded can be read from
+            the simulation of the session. Defaults to False.
+        gridlock_window_seconds (float, optional): Abort the simulation if it gets stuck. Without a session a
+            GridlockError is raised, with one the description of the gridlock is left in the simulation of the
+            session. Defaults to None.
+        route_output (str, optional): Whether the route file lists the vehicles or flows, see generate_routefile.
+            Defaults to "vehicles".
+        route_cache_dir (str, optional): Directory of the cached route files, see RouteCache. Defaults to
+            "data/routes".
+        seconds (int, optional): Seconds in which vehicles are introduced, see generate_routefile. Defaults to
+            DEMAND_SECONDS.
+        arrivals (str, optional): Distribution of the arrivals, "bernoulli" or "poisson", see generate_routefile.
+            Defaults to "bernoulli".
+        profile (callable or array, optional): Factor of the rates in each second, see generate_routefile. A
+            function bypasses the route cache. Defaults to None.
+
+    Returns:
+        (double, double, double): average density, flow and velocity of the city
+
+    Raises:
+        GridlockError: if the simulation got stuck and no session was given
+    """
+    # first, generate the route file for this simulation
+    traffic = dict(pWE=pWE, pNS=pNS, pEW=pEW, pSN=pSN, dWE=dWE, dNS=dNS, pEmergency=pEmergency, pFlaw=pFlaw,
+                   city_size=city_size, seed=seed, output=route_output, seconds=seconds, arrivals=arrivals, profile=profile)
+    if routefile is None:
+        routefile = cached_routefile(route_cache_dir, **traffic)
+    else:
+        generate_routefile(routefile=routefile, **traffic)
     print(routefile)
-    generate_routefile(pWE=pWE, pNS=pNS, pEW=pEW, pSN=pSN, dWE=dWE, dNS=dNS, pEmergency=pEmergency, pFlaw=pFlaw, routefile=routefile, city_size=city_size)
 
-    cfg_sumo_file = f"data/ciudad{city_size}x{city_size}_semaforo.sumocfg" if traffic_lights else f"data/cross{city_size}x{city_size}.sumocfg"
+    cfg_sumo_file = sumo_cfg_file(city_size, traffic_lights)
 
     # this is the normal way of using traci. sumo is started as a
     # subprocess and then the python script connects and runs
@@ -346,40 +332,123 @@ def generate_traffic_and_execute_sumo(sumoBinary, output_path, pWE = 0.1, pNS =
     #            "--step-length", "0.2",
     #            "--tripinfo-output", output_path])
 
-    traci.start([sumoBinary, "-c", cfg_sumo_file,
+    # With libsumo sumo runs inside this process and the binary is ignored, there is no gui available
+    if traci.is_libsumo() and "gui" in str(sumoBinary):
+        print("libsumo does not support the gui, running without it")
+
+    options = ["--route-files", routefile,
                "--collision.mingap-factor", "0",
                "--step-length", "0.2",
-               "--tripinfo-output", output_path])
-
+               "--tripinfo-output", output_path]
+    if route_output == "flows":
+        # sumo draws the vehicles of the flows
+        options += ["--seed", str(seed)]
+    if convergence_tolerance is not None:
+        # The run may stop with vehicles still driving, their trips up to then keep the waiting times unbiased
+        options += ["--tripinfo-output.write-unfinished"]
     density = (pSN + pNS + pEW + pWE)/4
-    density_calc, flow, vel = run(traffic_lights, trafficlights_flaws, city_size=city_size, density=density)
+    if session is None:
+        traci.start([sumoBinary, "-c", cfg_sumo_file] + options, label=label)
+        density_calc, flow, vel = run(traffic_lights, trafficlights_flaws, city_size=city_size, density=density, plot=plot,
+                                      convergence_tolerance=convergence_tolerance, auto_warm_up=auto_warm_up,
+                                      gridlock_window_seconds=gridlock_window_seconds, demand_seconds=seconds)
+    else:
+        state = session.load(cfg_sumo_file, options)
+        density_calc, flow, vel = run(traffic_lights, trafficlights_flaws, city_size=city_size, density=density, plot=plot,
+                                      state=state, convergence_tolerance=convergence_tolerance, auto_warm_up=auto_warm_up,
+                                      gridlock_window_seconds=gridlock_window_seconds, demand_seconds=seconds)
+        # Let sumo write the tripinfo file before anybody reads it
+        session.finish()
     return density_calc[0], flow[0], vel[0]
 
 
-def run_batch(sumoBinary, vph_combinations, dec_array, traffic_lights):
+def fork_variants_after_warm_up(sumoBinary, output_prefix, variants, traffic_lights=False, city_size=2, session=None,
+                                route_cache_dir="data/routes", **traffic):
+    """ Simulates the warm up once and forks a measured simulation from its end for each variant
+
+    Args:
+        sumoBinary (str): Binary of sumo
+        output_prefix (str): Prefix of the files of the simulation: snapshot and the tripinfo of each variant
+        variants (list of dict): Values of SimStateAndConfig to change in each variant, an empty dict keeps the
+            configuration of the warm up
+        traffic_lights (bool, optional): Whether the intersections are controlled by traffic lights. Defaults to False.
+        city_size (int, optional): Size of the city. Defaults to 2.
+        session (SimulationSession, optional): Session to run the simulations in, by default one is started and
+            closed at the end.
+        route_cache_dir (str, optional): Directory of the cached route files, see RouteCache. Defaults to
+            "data/routes".
+        traffic: Parameters of generate_routefile for the traffic of the simulation (pWE, pNS, pEmergency, seed,
+            seconds, arrivals, profile...)
+
+    Returns:
+        list of dict: the overrides of each variant with its density, flow, velocity and waiting times. The tripinfo
+            of the variants only has the vehicles that arrive after the warm up, plus the unfinished ones of the
+            variants that stop at convergence
+    """
+    routefile = cached_routefile(route_cache_dir, city_size=city_size, **traffic)
+    cfg_sumo_file = sumo_cfg_file(city_size, traffic_lights)
+    options = ["--route-files", routefile,
+               "--collision.mingap-factor", "0",
+               "--step-length", "0.2"]
+    close = session is None
+    if session is None:
+        session = SimulationSession(sumoBinary, label=f"fork_{os.getpid()}")
+
+    # Warm up once and save the state reached
+    state = session.load(cfg_sumo_file, options + WarmUpSnapshot.SAVE_OPTIONS)
+    step = simulate(state, traffic_lights, stop_step=state.config.warm_up_steps)
+    snapshot = WarmUpSnapshot.save(state, step, output_prefix)
+
+    # Each variant only simulates its measurement window
+    results = []
+    for i, overrides in enumerate(variants):
+        tripinfo = f"{output_prefix}_{i}.tripinfo.xml"
+        tripinfo_options = ["--tripinfo-output", tripinfo]
+        if overrides.get("convergence_tolerance") is not None:
+            # Keep the trips of the vehicles still driving when the variant converges, see
+            # generate_traffic_and_execute_sumo
+            tripinfo_options += ["--tripinfo-output.write-unfinished"]
+        state = session.load(cfg_sumo_file, options + tripinfo_options, snapshot=snapshot,
+                             config_overrides=overrides)
+        step = simulate(state, traffic_lights, step=snapshot.step)
+        report_convergence(state, step, traffic.get("seconds", DEMAND_SECONDS))
+        density_calc, flow, vel = summarize(state, city_size=city_size, plot=False)
+        session.finish()
+        waiting_time, waiting_time_priority = emergency_control(tripinfo)
+        results.append(dict(overrides=overrides, tripinfo=tripinfo, density=density_calc[0], flow=flow[0],
+                            velocity=vel[0], waiting_time=waiting_time, waiting_time_priority=waiting_time_priority,
+                            warm_up_steps=state.warm_up_steps_used, gridlock=state.gridlock))
+    if close:
+        session.close()
+    return results
+
+
+# The demand options (seconds, arrivals and profile, see generate_routefile) are the same for all the points, they are
+# sent to the worker processes so a profile must be an array rather than a function to run them in a pool
+def run_batch(sumoBinary, vph_combinations, dec_array, traffic_lights, processes=None, seconds=DEMAND_SECONDS,
+              arrivals="bernoulli", profile=None):
     # Create the path to store the results and make sure it exists in the file system
     file_prefix = f"data/results/{datetime.date.today().isoformat()}"
     Path(file_prefix).mkdir(parents=True, exist_ok=True)
 
-    # Iterate the parameter space generating the traffic and executing the simulations
+    # Iterate the parameter space generating the traffic for each of the simulations
+    points = []
     for vph in vph_combinations:
         for j, we_dec in enumerate(dec_array):
             for ns_dec in dec_array:
                 file = f"{file_prefix}/tripinfo__t_{vph[1]}_{vph[0]}__d_{we_dec}_{ns_dec}.xml"
                 print(file)
-                generate_traffic_and_execute_sumo(sumoBinary, file, pWE=vph[1]/3600, pNS=vph[0]/3600, pSN=vph[0]/3600,
-                                                  pEW=vph[0] / 3600, dWE=we_dec, dNS=ns_dec, pEmergency=0.01,
-                                                  traffic_lights=traffic_lights, city_size=5)
-def emergency_control():
-    tree = ET.parse('data/out-tripinfo.xml')
-    root = tree.getroot()
-
-    list_emergency_times = []
-    list_total_times = []
-    for tripinfo in root:
-        if "emergency" in tripinfo.attrib.get("id"):
-            list_emergency_times.append(float(tripinfo.attrib.get("waitingTime")))
-        list_total_times.append(float(tripinfo.attrib.get("waitingTime")))
+                points.append(dict(sumoBinary=sumoBinary, output_path=file, pWE=vph[1]/3600, pNS=vph[0]/3600,
+                                   pSN=vph[0]/3600, pEW=vph[0] / 3600, dWE=we_dec, dNS=ns_dec, pEmergency=0.01,
+                                   traffic_lights=traffic_lights, city_size=5, seconds=seconds, arrivals=arrivals,
+                                   profile=profile))
+    # Execute the simulations using all the cores
+    return SweepExecutor(processes=processes, libsumo=traci.is_libsumo()).run(points, prefix="batch")
+
+def emergency_control(tripinfo_file='data/out-tripinfo.xml'):
+    trips = TripinfoReader.read(tripinfo_file)
+    list_emergency_times = trips["waitingTime"][trips["is_emergency"]]
+    list_total_times = trips["waitingTime"]
 
     waiting_times = mean_confidence_interval(list_total_times)
     waiting_times_priority = mean_confidence_interval(list_emergency_times)
@@ -417,7 +486,9 @@ def generate_plots(velocities, flows, waiting_times, waiting_times_priority, cit
         plt.savefig(f'data/plots/results/densityXwaitingprior{name}{suffix}.png')
         plt.clf()
 
-def run_experiment(city_size=2, density_emergency=0.01, traffic_lights=False):
+# The demand options are the ones of run_batch
+def run_experiment(city_size=2, density_emergency=0.01, traffic_lights=False, processes=None, auto_warm_up=False,
+                   seconds=DEMAND_SECONDS, arrivals="bernoulli", profile=None):
     simulation_stats = {
         "velocities": [],
         "flows": [0],
@@ -435,26 +506,37 @@ def run_experiment(city_size=2, density_emergency=0.01, traffic_lights=False):
         with open(f'data/simulation_stats{city_size}x{city_size}{name_emergency}{name_traffic_lights}.txt', 'w+') as outfile:
             json.dump(simulation_stats, outfile)
     with open(f'data/simulation_stats{city_size}x{city_size}{name_emergency}{name_traffic_lights}.txt', 'w') as outfile:
-        for d in np.arange(0.1 * len(simulation_stats["flows"]), 1.1, 0.1):
-            print("vamos a comenzar desde la densidad", d)
-            print(simulation_stats)
-            density_calc, flow, velocity = generate_traffic_and_execute_sumo(checkBinary('sumo-gui'), # para modificar la interfaz grafica
-                                                                             "data/out-tripinfo.xml", dNS=0.0, dWE=0.0,
-                                                                             pNS=d, pWE=d,
-                                                                             pSN=d, pEW=d, pEmergency=density_emergency,
-                                                                             pFlaw=0.0,
-                                                                             traffic_lights=traffic_lights,
-                                                                             trafficlights_flaws=0.25,
-                                                                             city_size=city_size)
-
-            waiting_normal, waiting_priority = emergency_control()
+        # Opening the file empties it, write back the stats loaded until the first density is done
+        json.dump(simulation_stats, outfile)
+        outfile.flush()
+        densities = np.arange(0.1 * len(simulation_stats["flows"]), 1.1, 0.1)
+        print("vamos a comenzar desde la densidad", densities[:1])
+        print(simulation_stats)
+        # Execute the simulations of all the remaining densities using all the cores, the graphical interface is only
+        # used when they run one at a time in this process
+        sumoBinary = checkBinary('sumo-gui') if processes == 1 else checkBinary('sumo') # para modificar la interfaz grafica
+        points = [dict(sumoBinary=sumoBinary,
+                       dNS=0.0, dWE=0.0, pNS=d, pWE=d, pSN=d, pEW=d, pEmergency=density_emergency, pFlaw=0.0,
+                       traffic_lights=traffic_lights, trafficlights_flaws=0.25, city_size=city_size,
+                       auto_warm_up=auto_warm_up, seconds=seconds, arrivals=arrivals, profile=profile)
+                  for d in densities]
+        # Save the stats as each density is done, in order, so an interrupted experiment resumes from the first one
+        # missing
+        results = SweepExecutor(processes=processes, libsumo=traci.is_libsumo()).results(points, prefix=f"experiment{city_size}x{city_size}")
+        for result in results:
+            velocity = result["velocity"]
+            flow = result["flow"]
+            waiting_normal, waiting_priority = result["waiting_time"], result["waiting_time_priority"]
             simulation_stats["velocities"].append(velocity)
             simulation_stats["flows"].append(flow)
             simulation_stats["waiting_times"].append(waiting_normal)
+            # Older stats files do not have the warm up of each density
+            simulation_stats.setdefault("warm_up_steps", []).append(result["warm_up_steps"])
             if waiting_priority == waiting_priority:
                 simulation_stats["waiting_times_priority"].append(waiting_priority)
             outfile.seek(0)
             json.dump(simulation_stats, outfile)
+            outfile.flush()
 
         outfile.seek(0)
         json.dump(simulation_stats, outfile)
@@ -465,6 +547,8 @@ def run_experiment(city_size=2, density_emergency=0.01, traffic_lights=False):
 def main(options = None):
      # this script has been called from the command line. It will start sumo as a
     # server, then connect and run
+    # Select the library to control sumo before starting any simulation
+    traci.use(libsumo=getattr(options, "libsumo", None))
     if hasattr(options, "nogui") and (not options.nogui) and False:
         sumoBinary = checkBinary('sumo')
         
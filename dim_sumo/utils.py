@@ -1,3 +1,4 @@
+import math
 import numpy as np
 import scipy.stats
 
@@ -7,4 +8,105 @@ def mean_confidence_interval(data, confidence=0.95):
     n = len(a)
     m, se = np.mean(a), scipy.stats.sem(a)
     h = se * scipy.stats.t.ppf((1 + confidence) / 2., n-1)
-    return m, m-h, m+h
\ No newline at end of file
+    return m, m-h, m+h
+
+def mser_truncation(data, batch_size=5):
+    """Finds the end of the initial transient of a series with the MSER rule (MSER-5 with the default batch size):
+    the series is averaged in batches and truncated where the squared standard error of the mean of the rest is
+    minimal, looking only at the first half so the estimate keeps enough values.
+
+    Args:
+        data (list of float): Series to truncate
+        batch_size (int, optional): Number of consecutive values averaged in each batch. Defaults to 5.
+
+    Returns:
+        int: number of values to discard from the beginning of the series
+    """
+    batches = len(data) // batch_size
+    if batches < 2:
+        return 0
+    means = np.asarray(data[:batches * batch_size], dtype=float).reshape(batches, batch_size).mean(axis=1)
+    # Sums of the batches from each one to the end, to get the mean and variance of every truncation at once
+    sums = np.cumsum(means[::-1])[::-1]
+    squared_sums = np.cumsum((means ** 2)[::-1])[::-1]
+    remaining = np.arange(batches, 0, -1)
+    candidates = batches // 2 + 1
+    squared_errors = (squared_sums[:candidates] - sums[:candidates] ** 2 / remaining[:candidates]) / remaining[:candidates] ** 2
+    return int(np.argmin(squared_errors)) * batch_size
+
+class OnlineStatistics:
+    """Mean, variance, minimum and maximum of a series updated one value at a time with Welford's algorithm,
+    so the series does not need to be stored to summarize it.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._sum_squared_deltas = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._sum_squared_deltas += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def variance(self):
+        """Sample variance of the values added so far"""
+        if self.count < 2:
+            return math.nan
+        return self._sum_squared_deltas / (self.count - 1)
+
+    def confidence_interval(self, confidence=0.95):
+        """Confidence interval of the mean in the same format as mean_confidence_interval
+
+        Returns:
+            (float, float, float): mean, lower and upper bounds of the interval
+        """
+        if self.count < 2:
+            return self.mean if self.count > 0 else math.nan, math.nan, math.nan
+        h = math.sqrt(self.variance() / self.count) * scipy.stats.t.ppf((1 + confidence) / 2., self.count - 1)
+        return self.mean, self.mean - h, self.mean + h
+
+class BatchMeans:
+    """Confidence interval of the mean of an autocorrelated series, like the city metrics step after step, with the
+    method of batch means: the series is split in batches of consecutive values whose means are nearly independent,
+    so the interval is computed over the means of the batches.
+    """
+
+    def __init__(self, batch_size):
+        """
+        Args:
+            batch_size (int): Number of consecutive values in each batch
+        """
+        self.batch_size = batch_size
+        self.batch = OnlineStatistics()
+        self.batch_means = OnlineStatistics()
+
+    def add(self, value):
+        self.batch.add(value)
+        if self.batch.count == self.batch_size:
+            self.batch_means.add(self.batch.mean)
+            self.batch = OnlineStatistics()
+
+    def confidence_interval(self, confidence=0.95):
+        """Confidence interval of the mean computed over the completed batches, see OnlineStatistics"""
+        return self.batch_means.confidence_interval(confidence)
+
+    def converged(self, tolerance, min_batches=10, confidence=0.95):
+        """Whether the half width of the confidence interval is under a tolerance relative to the mean
+
+        Args:
+            tolerance (float): Maximum half width as a fraction of the mean, eg: 0.05 for 5%
+            min_batches (int, optional): Batches needed before deciding. Defaults to 10.
+            confidence (float, optional): Confidence of the interval. Defaults to 0.95.
+        """
+        if self.batch_means.count < max(min_batches, 2):
+            return False
+        mean, lower, upper = self.confidence_interval(confidence)
+        return (upper - lower) / 2 <= tolerance * abs(mean)